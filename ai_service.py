@@ -1,30 +1,287 @@
-from openai import OpenAI
+import asyncio
+import random
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from config import config
+from metrics import metrics
 import json
 
+# Errors worth retrying: 429, connection problems/timeouts, 5xx.
+TRANSIENT_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+@dataclass
+class CompletionResult:
+    text: Optional[str]
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    attempts: int = 1
+    finish_reason: Optional[str] = None # 'length' means the output was cut off
+
+
+@dataclass
+class ModelUsage:
+    calls: int = 0
+    errors: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0 # Sum over successful calls
+
+    @property
+    def avg_latency(self) -> float:
+        return self.latency / self.calls if self.calls else 0.0
+
+
+class UsageStats:
+    """Thread-safe per-model aggregate of API calls, tokens and latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, ModelUsage] = {}
+
+    def _model(self, model: str) -> ModelUsage:
+        return self._models.setdefault(model, ModelUsage())
+
+    def record(self, result: CompletionResult):
+        with self._lock:
+            usage = self._model(result.model)
+            usage.calls += 1
+            usage.prompt_tokens += result.prompt_tokens
+            usage.completion_tokens += result.completion_tokens
+            usage.latency += result.latency
+        metrics.inc('ai_calls_total', model=result.model)
+        metrics.inc('ai_tokens_total', result.prompt_tokens, model=result.model, kind='prompt')
+        metrics.inc('ai_tokens_total', result.completion_tokens, model=result.model, kind='completion')
+
+    def record_retry(self, model: str):
+        with self._lock:
+            self._model(model).retries += 1
+        metrics.inc('ai_retries_total', model=model)
+
+    def record_error(self, model: str):
+        with self._lock:
+            self._model(model).errors += 1
+        metrics.inc('ai_errors_total', model=model)
+
+    def snapshot(self) -> Dict[str, ModelUsage]:
+        with self._lock:
+            return {model: ModelUsage(**vars(usage)) for model, usage in self._models.items()}
+
+    def reset(self) -> Dict[str, ModelUsage]:
+        """Returns the current totals and starts a new accounting period."""
+        with self._lock:
+            models, self._models = self._models, {}
+        return models
+
+    @staticmethod
+    def format(models: Dict[str, ModelUsage]) -> str:
+        if not models:
+            return "no API calls"
+        return "; ".join(
+            f"{model}: {u.calls} calls, {u.prompt_tokens}+{u.completion_tokens} tokens, "
+            f"avg {u.avg_latency:.1f}s, {u.retries} retries, {u.errors} errors"
+            for model, u in models.items()
+        )
+
+
 class AIService:
+    """
+    OpenAI-compatible chat client with one pooled HTTP client per mode (sync,
+    and async per event loop), configurable timeouts, jittered exponential
+    retries on transient errors, and token/latency accounting in self.usage.
+    """
+
     def __init__(self):
+        self.timeout = httpx.Timeout(config.AI_TIMEOUT_SECONDS, connect=10.0)
+        self.limits = httpx.Limits(
+            max_connections=config.AI_MAX_CONNECTIONS,
+            max_keepalive_connections=config.AI_MAX_CONNECTIONS
+        )
+        self.max_retries = config.AI_MAX_RETRIES
+        self.usage = UsageStats()
+        # Retries are ours (with jitter and accounting), so the SDK's are off.
         self.client = OpenAI(
             base_url=config.AI_BASE_URL,
-            api_key=config.AI_API_KEY
+            api_key=config.AI_API_KEY,
+            timeout=self.timeout,
+            max_retries=0,
+            http_client=DefaultHttpxClient(timeout=self.timeout, limits=self.limits)
+        )
+        # httpx async pools are bound to the event loop that created them.
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """The pooled AsyncOpenAI client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=config.AI_BASE_URL,
+                api_key=config.AI_API_KEY,
+                timeout=self.timeout,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(timeout=self.timeout, limits=self.limits)
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def _request_kwargs(self, messages, model, response_format) -> Dict:
+        kwargs = {
+            "model": model,
+            "messages": messages,
+        }
+        if response_format:
+            # Support for JSON mode if API supports it, or just prompt
+            # Some OpenAI compatible APIs might not support strict json_object
+            # We'll try to just ask for it in prompt, but passing it if confident
+            kwargs["response_format"] = response_format
+        return kwargs
+
+    def _retry_delay(self, attempt: int, error: BaseException) -> float:
+        """Full-jitter exponential backoff, never shorter than Retry-After."""
+        cap = min(config.AI_RETRY_MAX_SECONDS, config.AI_RETRY_BASE_SECONDS * (2 ** attempt))
+        delay = random.uniform(0, cap)
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get('retry-after', 0)))
+            except ValueError:
+                pass
+        return delay
+
+    def _result(self, response, model: str, start: float, attempts: int) -> CompletionResult:
+        usage = getattr(response, 'usage', None)
+        result = CompletionResult(
+            text=response.choices[0].message.content,
+            model=model,
+            prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+            completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+            latency=time.monotonic() - start,
+            attempts=attempts,
+            finish_reason=response.choices[0].finish_reason,
         )
+        self.usage.record(result)
+        return result
+
+    def complete(self, messages, model, response_format=None) -> CompletionResult:
+        """Blocking completion with retries. Raises the last API error."""
+        kwargs = self._request_kwargs(messages, model, response_format)
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+                return self._result(response, model, start, attempt + 1)
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self.usage.record_error(model)
+                    raise
+                self.usage.record_retry(model)
+                time.sleep(self._retry_delay(attempt, e))
+            except Exception:
+                self.usage.record_error(model)
+                raise
+
+    def complete_stream(self, messages, model, on_text: Callable[[str], None],
+                        response_format=None) -> CompletionResult:
+        """
+        Streaming completion: on_text receives each text delta as it arrives,
+        and the full result is returned at the end. Transient errors are
+        retried only until the first delta; after that they propagate, and
+        whatever the caller already consumed stays valid.
+        """
+        kwargs = self._request_kwargs(messages, model, response_format)
+        kwargs["stream"] = True
+        kwargs["stream_options"] = {"include_usage": True}
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            parts = []
+            try:
+                usage = None
+                finish_reason = None
+                with self.client.chat.completions.create(**kwargs) as stream:
+                    for chunk in stream:
+                        if chunk.usage:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        choice = chunk.choices[0]
+                        finish_reason = choice.finish_reason or finish_reason
+                        delta = choice.delta.content if choice.delta else None
+                        if delta:
+                            parts.append(delta)
+                            on_text(delta)
+                result = CompletionResult(
+                    text="".join(parts),
+                    model=model,
+                    prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                    completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+                    latency=time.monotonic() - start,
+                    attempts=attempt + 1,
+                    finish_reason=finish_reason,
+                )
+                self.usage.record(result)
+                return result
+            except (*TRANSIENT_ERRORS, httpx.TransportError) as e:
+                # httpx errors surface unwrapped when the connection drops mid-stream.
+                if parts or attempt >= self.max_retries:
+                    self.usage.record_error(model)
+                    raise
+                self.usage.record_retry(model)
+                time.sleep(self._retry_delay(attempt, e))
+            except Exception:
+                self.usage.record_error(model)
+                raise
+
+    async def acomplete(self, messages, model, response_format=None) -> CompletionResult:
+        """Async completion with retries on the shared async pool. Raises the last API error."""
+        kwargs = self._request_kwargs(messages, model, response_format)
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                response = await self.async_client.chat.completions.create(**kwargs)
+                return self._result(response, model, start, attempt + 1)
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self.usage.record_error(model)
+                    raise
+                self.usage.record_retry(model)
+                await asyncio.sleep(self._retry_delay(attempt, e))
+            except Exception:
+                self.usage.record_error(model)
+                raise
+
+    def chat_completion(self, messages, model, response_format=None, raise_errors=False):
+        """
+        Returns the completion text, or None on error.
+        With raise_errors=True the API exception propagates instead, so callers
+        can react to rate limits and timeouts.
+        """
+        try:
+            return self.complete(messages, model, response_format).text
+        except Exception as e:
+            print(f"AI Service Error: {e}")
+            if raise_errors:
+                raise
+            return None
 
-    def chat_completion(self, messages, model, response_format=None):
+    async def achat_completion(self, messages, model, response_format=None, raise_errors=False):
+        """Async counterpart of chat_completion."""
         try:
-            kwargs = {
-                "model": model,
-                "messages": messages,
-            }
-            if response_format:
-                # Support for JSON mode if API supports it, or just prompt
-                # Some OpenAI compatible APIs might not support strict json_object
-                # We'll try to just ask for it in prompt, but passing it if confident
-                kwargs["response_format"] = response_format
-
-            response = self.client.chat.completions.create(**kwargs)
-            return response.choices[0].message.content
+            return (await self.acomplete(messages, model, response_format)).text
         except Exception as e:
             print(f"AI Service Error: {e}")
+            if raise_errors:
+                raise
             return None
 
 ai_service = AIService()
@@ -0,0 +1,227 @@
+"""
+End-to-end pipeline benchmark against local mock servers (bench.mock_servers).
+
+Usage (from the repo root):
+    python -m bench.bench_e2e [--cycles 3] [--feeds 20] [--items 50] [--new-per-cycle 5]
+                              [--llm-latency 0.5] [--llm-error-rate 0.05]
+                              [--json result.json] [--baseline old.json] [--tolerance 0.2]
+
+The synthetic feeds and the mock LLM run in a child process, so they share
+neither the GIL nor the peak RSS figure with the pipeline. The pipeline runs
+here against a fresh database in a temporary directory. Each cycle has the
+feeds publish new items and then runs fetch -> dedup -> L1 -> L2 -> rank/write
+with the same stage functions main.py uses. The first cycle ingests the
+whole backlog. Pipeline output is silenced unless --verbose.
+
+Reports per-cycle stage times, throughput per stage, p50/p99 per timed span
+(see metrics.py), API usage and peak RSS. With --baseline, the run exits with
+status 1 when a throughput drops, or a p99 or the peak RSS grows, by more than
+--tolerance compared to an earlier --json result.
+"""
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+from bench.mock_servers import add_arguments, serve
+
+try:
+    import resource
+except ImportError: # Windows: no peak RSS figure
+    resource = None
+
+STAGES = ('fetch', 'dedup', 'l1', 'l2', 'rank', 'write')
+SPANS = ('fetch_feed', 'ingest', 'l1_call', 'l2_call') + STAGES
+NOISE_FLOOR_SECONDS = 0.005 # p99 changes below this are not regressions
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def start_servers(args):
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    process = ctx.Process(target=serve, args=(args, ready), name="bench-mock-servers", daemon=True)
+    process.start()
+    feed_urls, llm_base_url, advance_url = ready.get(timeout=30)
+    return process, feed_urls, llm_base_url, advance_url
+
+
+def configure_environment(feed_urls: List[str], llm_base_url: str):
+    """Points the app at the mock servers. Must run before any app module is imported."""
+    os.environ.update({
+        'AI_BASE_URL': llm_base_url,
+        'AI_API_KEY': 'bench',
+        'RSS_FEEDS': json.dumps(feed_urls),
+        'AI_RETRY_BASE_SECONDS': '0.2',
+        'AI_RETRY_MAX_SECONDS': '1',
+        'METRICS_JSON_LOGS': 'false',
+        'DASHBOARD_OUTPUT_PATH': 'data/dashboard.json',
+        'NO_PROXY': '127.0.0.1,localhost',
+        'no_proxy': '127.0.0.1,localhost',
+    })
+
+
+def run_pipeline(args, advance_url: str) -> Dict:
+    # Imported late: config reads the environment, and the database opens
+    # data/news.db in the working directory, at import time.
+    import main as pipeline
+    from ai_service import ai_service
+    from metrics import metrics
+    from sources.manager import source_manager
+
+    metrics.keep_samples()
+    totals = {'new': 0, 'l1': 0, 'l2': 0}
+    stage_seconds = {stage: 0.0 for stage in ('fetch', 'l1', 'l2', 'rank')}
+    sink = sys.stdout if args.verbose else open(os.devnull, 'w')
+    print(f"{'cycle':>5} {'new':>6} {'l1':>6} {'l2':>6} {'fetch':>8} {'l1':>8} {'l2':>8} {'rank':>8}")
+    start = time.perf_counter()
+    try:
+        for cycle in range(args.cycles):
+            if cycle:
+                urllib.request.urlopen(urllib.request.Request(advance_url, method='POST'), timeout=10).close()
+            with contextlib.redirect_stdout(sink):
+                t0 = time.perf_counter()
+                with metrics.span('fetch'):
+                    new = source_manager.fetch_all().new_items
+                t1 = time.perf_counter()
+                l1 = pipeline.run_l1()
+                t2 = time.perf_counter()
+                l2 = pipeline.run_l2()
+                t3 = time.perf_counter()
+                pipeline.run_rank()
+                t4 = time.perf_counter()
+            row = {'fetch': t1 - t0, 'l1': t2 - t1, 'l2': t3 - t2, 'rank': t4 - t3}
+            for stage, seconds in row.items():
+                stage_seconds[stage] += seconds
+            totals['new'] += new
+            totals['l1'] += l1
+            totals['l2'] += l2
+            print(f"{cycle:>5} {new:>6} {l1:>6} {l2:>6} " + " ".join(f"{row[s]:>7.2f}s" for s in ('fetch', 'l1', 'l2', 'rank')))
+    finally:
+        if sink is not sys.stdout:
+            sink.close()
+    elapsed = time.perf_counter() - start
+
+    def rate(count: int, seconds: float) -> float:
+        return count / seconds if seconds else 0.0
+
+    samples = metrics.samples()
+    usage = ai_service.usage.snapshot()
+    return {
+        'elapsed_seconds': elapsed,
+        'items': totals,
+        'throughput': {
+            'fetch_new_items_per_s': rate(totals['new'], stage_seconds['fetch']),
+            'l1_items_per_s': rate(totals['l1'], stage_seconds['l1']),
+            'l2_items_per_s': rate(totals['l2'], stage_seconds['l2']),
+            'end_to_end_items_per_s': rate(totals['new'], elapsed),
+        },
+        'spans': {
+            span: {'count': len(samples[span]), 'p50': percentile(samples[span], 50), 'p99': percentile(samples[span], 99)}
+            for span in SPANS if samples.get(span)
+        },
+        'api': {model: vars(u) for model, u in usage.items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def report(result: Dict):
+    print(f"\nTotal {result['elapsed_seconds']:.2f}s; items: {result['items']}")
+    print("\nThroughput:")
+    for name, value in result['throughput'].items():
+        print(f"  {name:<24} {value:10.1f}")
+    print(f"\n{'span':<12} {'count':>6} {'p50':>9} {'p99':>9}")
+    for span, stats in result['spans'].items():
+        print(f"{span:<12} {stats['count']:>6} {stats['p50'] * 1000:>7.1f}ms {stats['p99'] * 1000:>7.1f}ms")
+    print("\nAPI:")
+    for model, u in result['api'].items():
+        print(f"  {model}: {u['calls']} calls, {u['prompt_tokens']}+{u['completion_tokens']} tokens, "
+              f"{u['retries']} retries, {u['errors']} errors")
+    if result['peak_rss_mb'] is not None:
+        print(f"\nPeak RSS: {result['peak_rss_mb']:.1f} MiB")
+
+
+def regressions(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    found = []
+    for name, old in baseline.get('throughput', {}).items():
+        new = result['throughput'].get(name)
+        if new is not None and old and new < old * (1 - tolerance):
+            found.append(f"{name}: {new:.1f} < {old:.1f}")
+    for span, old in baseline.get('spans', {}).items():
+        new = result['spans'].get(span)
+        if new and new['p99'] > old['p99'] * (1 + tolerance) and new['p99'] - old['p99'] > NOISE_FLOOR_SECONDS:
+            found.append(f"{span} p99: {new['p99'] * 1000:.1f}ms > {old['p99'] * 1000:.1f}ms")
+    old_rss, new_rss = baseline.get('peak_rss_mb'), result['peak_rss_mb']
+    if old_rss and new_rss and new_rss > old_rss * (1 + tolerance):
+        found.append(f"peak RSS: {new_rss:.1f} MiB > {old_rss:.1f} MiB")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--cycles", type=int, default=3, help="Fetch/process cycles (the first ingests the backlog)")
+    parser.add_argument("--json", help="Write the result to this file")
+    parser.add_argument("--baseline", help="Compare against an earlier --json result")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression against --baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    process, feed_urls, llm_base_url, advance_url = start_servers(args)
+    print(f"{args.feeds} feeds x {args.items} items (+{args.new_per_cycle}/cycle), "
+          f"LLM latency {args.llm_latency}s +/- {args.llm_jitter}s, error rate {args.llm_error_rate:.0%}")
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-e2e-") as tmp:
+            os.chdir(tmp)
+            configure_environment(feed_urls, llm_base_url)
+            result = run_pipeline(args, advance_url)
+            from database import db
+            db.close()
+            os.chdir(cwd)
+    finally:
+        process.terminate()
+
+    result['config'] = {name: value for name, value in vars(args).items() if name not in ('json', 'baseline', 'verbose')}
+    report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != result['config']:
+            print("\nNote: the baseline was recorded with different settings.")
+        found = regressions(result, baseline, args.tolerance)
+        if found:
+            print("\nRegressions against baseline:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
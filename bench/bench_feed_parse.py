@@ -0,0 +1,144 @@
+"""
+Feed parsing benchmark: feedparser over the whole document (the previous
+RSSFetcher path) vs the streaming parser (sources/stream.py), on a large
+synthetic feed file written to disk.
+
+Usage (from the repo root):
+    python -m bench.bench_feed_parse [--entries 5000] [--format rss|atom]
+                                     [--summary-bytes 2000] [--new 20] [--path feed.xml]
+
+Passes, each measured for Python heap peak (tracemalloc; the body itself
+is read before measuring) and wall time:
+  feedparser    every entry, full summaries kept
+  streamed      every entry
+  since         a poll after --new entries were added: stops at stored ones
+  capped        body cut off at a quarter of its size (FEED_MAX_BYTES)
+
+After measuring, the streamed items are checked against feedparser's
+(title, url, published_at, source name) and the early stop and cap are
+checked to keep exactly the expected entries.
+"""
+import argparse
+import calendar
+import os
+import tempfile
+import time
+import tracemalloc
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+
+import feedparser
+
+from sources.rss import RSSFetcher, WATERMARK_SLACK_SECONDS
+from sources.urls import clean_url, origin_url
+
+STEP_SECONDS = 600 # Between consecutive synthetic entries
+
+
+def write_feed(path: str, entries: int, fmt: str, summary_bytes: int, now: float):
+    """Writes a newest-first feed of `entries` entries to `path`, one entry at a time."""
+    filler = escape("<p>Synthetic summary paragraph with <b>markup</b> &amp; a link.</p> ")
+    filler = (filler * (summary_bytes // len(filler) + 1))[:summary_bytes]
+    with open(path, 'w', encoding='utf-8') as f:
+        if fmt == 'atom':
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">'
+                    '<title>Synthetic Atom</title><link href="https://example.com/"/>')
+        else:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>'
+                    '<title>Synthetic RSS</title><link>https://example.com/</link><ttl>30</ttl>')
+        for i in range(entries):
+            published = now - i * STEP_SECONDS
+            link = f"https://example.com/posts/{entries - i}?utm_source=feed"
+            title = escape(f"Synthetic headline {entries - i} about model releases")
+            if fmt == 'atom':
+                stamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(published))
+                f.write(f'<entry><title>{title}</title><link rel="alternate" href="{escape(link)}"/>'
+                        f'<id>{escape(link)}</id><updated>{stamp}</updated>'
+                        f'<summary type="html">{filler}</summary></entry>')
+            else:
+                f.write(f'<item><title>{title}</title><link>{escape(link)}</link>'
+                        f'<guid>{escape(link)}</guid><pubDate>{formatdate(published)}</pubDate>'
+                        f'<description>{filler}</description></item>')
+        f.write('</feed>' if fmt == 'atom' else '</channel></rss>')
+
+
+def feedparser_items(content: bytes):
+    """The previous RSSFetcher._parse: whole document, then a list with full summaries."""
+    feed = feedparser.parse(content)
+    source_name = feed.feed.get('title', 'Unknown Source')
+    items = []
+    for entry in feed.entries:
+        summary = entry.get('summary', '') or entry.get('description', '')
+        link = entry.get('link', '')
+        if not link:
+            continue
+        published = entry.get('published_parsed') or entry.get('updated_parsed')
+        items.append({
+            'title': entry.get('title', 'No Title'),
+            'url': clean_url(origin_url(link, summary)),
+            'published_at': calendar.timegm(published) if published else time.time(),
+            'source_name': source_name,
+            'summary': summary,
+        })
+    return items
+
+
+def key(items):
+    return [(item['title'], item['url'], item['published_at'], item['source_name']) for item in items]
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--format", choices=("rss", "atom"), default="rss")
+    parser.add_argument("--summary-bytes", type=int, default=2000, help="Summary HTML per entry")
+    parser.add_argument("--new", type=int, default=20, help="Entries added since the last poll (for the 'since' pass)")
+    parser.add_argument("--path", help="Write the synthetic feed here instead of a temporary file")
+    args = parser.parse_args()
+
+    now = float(int(time.time()))
+    with tempfile.TemporaryDirectory(prefix="bench-feed-parse-") as tmp:
+        path = args.path or os.path.join(tmp, f"feed.{args.format}.xml")
+        write_feed(path, args.entries, args.format, args.summary_bytes, now)
+        with open(path, 'rb') as f:
+            content = f.read()
+    print(f"{args.entries} {args.format} entries, {len(content) / 2**20:.1f} MiB")
+
+    fetcher = RSSFetcher()
+    url = "file://" + path
+    # The last poll saw everything but the newest --new entries.
+    since = now - args.new * STEP_SECONDS
+    cap = len(content) // 4
+    passes = {
+        'feedparser': lambda: feedparser_items(content),
+        'streamed': lambda: list(fetcher.iter_items(url, content)),
+        'since': lambda: list(fetcher.iter_items(url, content, since=since)),
+        'capped': lambda: list(fetcher.iter_items(url, content[:cap], truncated=True)),
+    }
+
+    results = {name: measure(run) for name, run in passes.items()}
+    reference = key(results['feedparser'][0])
+    assert key(results['streamed'][0]) == reference, "streamed items differ from feedparser"
+    # Everything newer than the watermark, the slack window, and the first entry past it.
+    expected = args.new + WATERMARK_SLACK_SECONDS // STEP_SECONDS + 2
+    assert key(results['since'][0]) == reference[:expected], "early stop kept the wrong entries"
+    capped = key(results['capped'][0])
+    assert capped and capped == reference[:len(capped)], "capped parse differs from the full one"
+
+    print(f"{'pass':<11} {'items':>7} {'peak heap':>11} {'time':>8}")
+    for name, (items, peak, seconds) in results.items():
+        print(f"{name:<11} {len(items):>7} {peak / 2**20:>7.1f} MiB {seconds:>7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
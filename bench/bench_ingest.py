@@ -0,0 +1,81 @@
+"""
+Ingest benchmark: per-item Database.add_news vs Database.add_news_bulk.
+
+Usage (from the repo root):
+    python -m bench.bench_ingest [--items 10000] [--feeds 50]
+
+Each path ingests the same synthetic feed set twice into a fresh temporary
+database: once cold (every item is new) and once warm (every item already
+exists), which is the steady state of a fetch cycle.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+from database import Database
+
+
+def make_feeds(n_items: int, n_feeds: int, seed: int = 42) -> List[List[Dict]]:
+    rng = random.Random(seed)
+    now = time.time()
+    feeds = [[] for _ in range(n_feeds)]
+    for i in range(n_items):
+        feed_idx = i % n_feeds
+        feeds[feed_idx].append({
+            'url': f"https://feed{feed_idx}.example.com/posts/{i}",
+            'title': f"Synthetic headline {i} " + "x" * rng.randint(10, 80),
+            'source_name': f"Feed {feed_idx}",
+            'published_at': now - rng.uniform(0, 72 * 3600),
+        })
+    return feeds
+
+
+def ingest_per_item(db: Database, feeds: List[List[Dict]]) -> int:
+    added = 0
+    for items in feeds:
+        for item in items:
+            if db.add_news(
+                url=item['url'],
+                title=item['title'],
+                source_name=item['source_name'],
+                published_at=item['published_at']
+            ):
+                added += 1
+    return added
+
+
+def ingest_bulk(db: Database, feeds: List[List[Dict]]) -> int:
+    return sum(db.add_news_bulk(items) for items in feeds)
+
+
+def run(name: str, ingest, feeds: List[List[Dict]], n_items: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(db_path=os.path.join(tmp, "bench.db"))
+        for phase in ("cold", "warm"):
+            start = time.perf_counter()
+            added = ingest(db, feeds)
+            elapsed = time.perf_counter() - start
+            rate = n_items / elapsed if elapsed else float('inf')
+            print(f"{name:<10} {phase:<5} {elapsed:8.3f}s  {rate:10.0f} items/s  ({added} new)")
+        close = getattr(db, 'close', None)
+        if close:
+            close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--feeds", type=int, default=50)
+    args = parser.parse_args()
+
+    feeds = make_feeds(args.items, args.feeds)
+    print(f"Ingesting {args.items} items across {args.feeds} feeds")
+    run("per-item", ingest_per_item, feeds, args.items)
+    run("bulk", ingest_bulk, feeds, args.items)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Ranking memory benchmark: the full-row ranking pass (every processed row in
+the window loaded as a dict, ranked, then projected) vs the streamed one
+main.run_rank uses (RankRow off the cursor into packed columns, with
+display fields loaded only for the exported top items).
+
+Usage (from the repo root):
+    python -m bench.bench_rank_memory [--rows 1000000] [--top-k 1000]
+
+Fills a temporary database with --rows processed items spread over the
+ranking window, each with a realistic summary and L1 reason. It then
+measures each pass separately: Python heap peak (tracemalloc) and wall
+time. SQLite's own page cache is outside tracemalloc and the same for
+both. Before measuring, the exported items are checked to be identical.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SUMMARY = "这是一段用于基准测试的摘要，长度与真实的 L2 摘要相近。" * 4
+REASON = "Relevant to AI infrastructure and model releases; worth a closer look."
+INSERT_SQL = '''
+    INSERT INTO news (url, url_key, title, source_name, published_at, fetched_at,
+                      l1_score, l1_reason, l2_score, l2_summary, l2_title_zh, category, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'processed')
+'''
+
+
+def fill(db, rows: int, window_hours: float, now: float, seed: int = 7):
+    rng = random.Random(seed)
+    conn = db.get_conn()
+    batch = []
+    with conn:
+        for i in range(rows):
+            published = now - rng.uniform(0, window_hours * 3600)
+            batch.append((
+                f"https://example.com/{i}", f"example.com/{i}", f"Synthetic headline number {i}", "bench",
+                published, published, rng.randint(60, 100), REASON, rng.randint(40, 100),
+                SUMMARY, f"合成标题 {i}", "AI",
+            ))
+            if len(batch) == 10000:
+                conn.executemany(INSERT_SQL, batch)
+                batch = []
+        if batch:
+            conn.executemany(INSERT_SQL, batch)
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def full_rows_pass(db, hours: float, gravity: float, now: float, top_k: int):
+    """The pre-streaming pass: SELECT * for the whole window, ranked as dicts."""
+    from output import build_dashboard
+    from ranking import rank_items
+    cutoff = now - hours * 3600
+    rows = db._get_conn().execute(
+        "SELECT * FROM news WHERE status = 'processed' AND published_at > ? ORDER BY published_at DESC", (cutoff,)
+    ).fetchall()
+    processed = [dict(row) for row in rows]
+    ranked = rank_items(processed, gravity, now=now)
+    return build_dashboard(ranked[:top_k], now)['items']
+
+
+def streamed_pass(db, hours: float, gravity: float, now: float, top_k: int):
+    """Same as main.run_rank."""
+    from output import DASHBOARD_FIELDS, build_dashboard
+    from ranking import rank_rows
+    top = rank_rows(db.iter_ranking_rows(hours), gravity, now=now, top_k=top_k)
+    items = db.get_news_fields([news_id for news_id, _ in top], DASHBOARD_FIELDS)
+    ranked = [(items[news_id], score) for news_id, score in top if news_id in items]
+    return build_dashboard(ranked, now)['items']
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="Processed rows in the ranking window")
+    parser.add_argument("--top-k", type=int, default=1000, help="Items exported (DASHBOARD_MAX_ITEMS)")
+    parser.add_argument("--gravity", type=float, default=1.1)
+    parser.add_argument("--window-hours", type=float, default=72)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    with tempfile.TemporaryDirectory(prefix="bench-rank-memory-") as tmp:
+        # The database opens data/news.db in the working directory at import time.
+        os.chdir(tmp)
+        from database import db
+        now = time.time()
+        start = time.perf_counter()
+        fill(db, args.rows, args.window_hours, now)
+        print(f"Filled {args.rows} rows in {time.perf_counter() - start:.1f}s; exporting the top {args.top_k}")
+
+        # The window is the fill span plus a minute, so every row is ranked.
+        hours = args.window_hours + 1 / 60
+        full, full_peak, full_seconds = measure(full_rows_pass, db, hours, args.gravity, now, args.top_k)
+        streamed, streamed_peak, streamed_seconds = measure(streamed_pass, db, hours, args.gravity, now, args.top_k)
+        assert full == streamed, "streamed ranking exports different items"
+
+        print(f"{'pass':<10} {'peak heap':>11} {'time':>8}")
+        print(f"{'full rows':<10} {full_peak / 2**20:>7.1f} MiB {full_seconds:>7.2f}s")
+        print(f"{'streamed':<10} {streamed_peak / 2**20:>7.1f} MiB {streamed_seconds:>7.2f}s")
+        print(f"Peak heap {full_peak / max(streamed_peak, 1):.1f}x lower")
+        db.close()
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Ranking benchmark: scalar calculate_gravity_score loop + full sort vs the
+vectorized rank_items pass (full order and top-K).
+
+Usage (from the repo root):
+    python -m bench.bench_ranking [--sizes 10000,100000,1000000] [--top-k 10]
+
+Before timing, every size is checked for agreement with the scalar
+reference: identical scores (to 1e-9) and identical ordering.
+"""
+import argparse
+import random
+import time
+
+import ranking
+from ranking import calculate_gravity_score, rank_items
+
+
+def make_rows(n: int, now: float, window_hours: float = 72, seed: int = 7):
+    rng = random.Random(seed)
+    return [
+        {'l2_score': rng.randint(40, 100), 'published_at': now - rng.uniform(0, window_hours * 3600)}
+        for _ in range(n)
+    ]
+
+
+def scalar_rank(rows, gravity: float, now: float):
+    ranked = [(row, calculate_gravity_score(row['l2_score'], row['published_at'], gravity, now)) for row in rows]
+    ranked.sort(key=lambda x: x[1], reverse=True)
+    return ranked
+
+
+def check_agreement(rows, gravity: float, now: float, top_k: int):
+    reference = scalar_rank(rows, gravity, now)
+    fast = rank_items(rows, gravity, now=now)
+    assert len(reference) == len(fast)
+    for (ref_row, ref_score), (row, score) in zip(reference, fast):
+        assert ref_row is row, "ordering differs from the scalar reference"
+        assert abs(ref_score - score) <= 1e-9, f"score mismatch: {ref_score} vs {score}"
+    top = rank_items(rows, gravity, now=now, top_k=top_k)
+    assert [row for row, _ in top] == [row for row, _ in reference[:top_k]], "top-K differs from full ranking"
+
+
+def timed(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--gravity", type=float, default=1.1)
+    args = parser.parse_args()
+
+    print(f"NumPy: {'yes' if ranking.np is not None else 'no (pure-Python fallback)'}")
+    print(f"{'rows':>9} {'scalar+sort':>12} {'vectorized':>11} {'top-' + str(args.top_k):>9}")
+    now = time.time()
+    for size in (int(s) for s in args.sizes.split(",")):
+        rows = make_rows(size, now)
+        check_agreement(rows, args.gravity, now, args.top_k)
+        t_scalar = timed(scalar_rank, rows, args.gravity, now)
+        t_vector = timed(rank_items, rows, args.gravity, now=now)
+        t_top = timed(rank_items, rows, args.gravity, now=now, top_k=args.top_k)
+        print(f"{size:>9} {t_scalar:>11.3f}s {t_vector:>10.3f}s {t_top:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
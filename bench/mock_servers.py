@@ -0,0 +1,341 @@
+"""
+Local stand-ins for the outside world, used by bench.bench_e2e.
+
+FeedServer serves synthetic RSS 2.0 feeds at /feed/<n>.xml. Each feed has a
+fixed backlog of items, and every POST /advance publishes `new_per_cycle`
+more items per feed. A share of the new items re-report a story from another
+feed under a near-identical title, so near-duplicate clustering has work.
+Responses carry an ETag, so unchanged feeds go down the 304 path.
+
+MockLLMServer is an OpenAI-compatible /v1/chat/completions endpoint, with and
+without streaming. Its answers follow the output formats in prompts/l1.md and
+prompts/l2.md. Verdicts are a pure function of the item title, so runs are
+reproducible. Latency, jitter and the share of requests that fail with a 429
+or a 500 are configurable.
+
+Standalone (e.g. to point main.py at it):
+    python -m bench.mock_servers [--feeds 20] [--items 50] [--llm-latency 0.5]
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+WORDS = (
+    "model agent inference kernel cluster launch orbit booster chip wafer "
+    "compiler runtime vector index cache scheduler release benchmark dataset "
+    "training quantized sparse attention context window latency throughput "
+    "gpu tpu npu memory bandwidth storage network outage patch exploit "
+    "satellite rocket engine landing reusable payload startup funding "
+    "export sanctions regulation open-source weights license framework "
+    "database replication consensus container kubernetes serverless edge "
+    "browser compiler language runtime garbage collector allocator driver"
+).split()
+SOURCES = ("Hacker News", "The Verge", "Ars Technica", "SpaceNews", "Phoronix", "The Register", "36Kr", "IT之家")
+L1_CATEGORIES = ("AI_Algorithms", "Aerospace_HardTech", "Major_Industry_Moves")
+L2_CATEGORIES = ("AI_Algo", "Dev_Infra", "Aerospace", "Hardware", "Policy_Biz")
+
+L1_LINE = re.compile(r'^(\d+)\. (.*) \(([^()]*)\)$', re.M)
+L2_LINE = re.compile(r'^(\d+)\. "(.*)" \(([^()]*)\) - (\S+)$', re.M)
+
+
+def title_score(title: str, salt: str) -> int:
+    """Deterministic 0-99 score for a title."""
+    return int.from_bytes(hashlib.blake2b(f"{salt}\x1f{title}".encode('utf-8'), digest_size=4).digest(), 'big') % 100
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FeedServer:
+    def __init__(self, feeds: int = 20, items: int = 50, new_per_cycle: int = 5,
+                 duplicate_rate: float = 0.2, seed: int = 42, port: int = 0):
+        self.n_feeds = feeds
+        self.new_per_cycle = new_per_cycle
+        self.duplicate_rate = duplicate_rate
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._feeds: List[List[Tuple[str, str, float]]] = [[] for _ in range(feeds)] # newest first: (title, link, published)
+        self._bodies: Dict[int, Tuple[bytes, str]] = {}
+        self._counter = 0
+        self._clock = time.time() - items * 600
+        for _ in range(items):
+            self._publish()
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def urls(self) -> List[str]:
+        return [f"http://127.0.0.1:{self.port}/feed/{n}.xml" for n in range(self.n_feeds)]
+
+    def _title(self) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(7, 12))).capitalize()
+
+    def _publish(self):
+        """Adds one item to every feed (caller holds the lock or is __init__)."""
+        self._clock = min(time.time(), self._clock + 600)
+        for n, items in enumerate(self._feeds):
+            self._counter += 1
+            others = [f for f in self._feeds if f is not items and f]
+            if others and self.rng.random() < self.duplicate_rate:
+                # Same story, another outlet: near-identical title, different URL.
+                title = self.rng.choice(others)[0][0] + " " + self.rng.choice(("report", "update", "analysis"))
+            else:
+                title = self._title()
+            items.insert(0, (title, f"https://feed{n}.example.com/posts/{self._counter}", self._clock))
+        self._bodies.clear()
+
+    def advance(self, cycles: int = 1):
+        with self._lock:
+            for _ in range(cycles * self.new_per_cycle):
+                self._publish()
+
+    def body(self, n: int) -> Tuple[bytes, str]:
+        with self._lock:
+            cached = self._bodies.get(n)
+            if cached is None:
+                entries = "".join(
+                    f"<item><title>{escape(title)}</title><link>{escape(link)}</link>"
+                    f"<guid>{escape(link)}</guid><pubDate>{formatdate(published)}</pubDate>"
+                    f"<description>{escape(title)}. Synthetic summary text for benchmarking.</description></item>"
+                    for title, link, published in self._feeds[n]
+                )
+                body = (f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+                        f'<title>{SOURCES[n % len(SOURCES)]}</title><link>https://feed{n}.example.com/</link>'
+                        f'{entries}</channel></rss>').encode('utf-8')
+                cached = self._bodies[n] = (body, f'"{hashlib.sha256(body).hexdigest()[:16]}"')
+            return cached
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = re.fullmatch(r'/feed/(\d+)\.xml', self.path)
+                if not match or int(match.group(1)) >= server.n_feeds:
+                    self.send_error(404)
+                    return
+                body, etag = server.body(int(match.group(1)))
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/rss+xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if self.path != '/advance':
+                    self.send_error(404)
+                    return
+                server.advance()
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.httpd.serve_forever, name="feed-server", daemon=True)
+        thread.start()
+        return thread
+
+
+class MockLLMServer:
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, error_rate: float = 0.0,
+                 chunk_chars: int = 24, seed: int = 42, port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_chars = chunk_chars
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    @staticmethod
+    def l1_answer(prompt: str) -> Dict:
+        """Entries for the items scoring >= 70; the rest are left out, as l1.md asks."""
+        out = {category: [] for category in L1_CATEGORIES}
+        for number, title, source in L1_LINE.findall(prompt):
+            score = 40 + title_score(title, 'l1') * 60 // 100
+            if score < 70:
+                continue
+            out[L1_CATEGORIES[title_score(title, 'cat') % len(L1_CATEGORIES)]].append({
+                "ids": [int(number)], "title": title, "sources": [source], "score": score, "context": None,
+            })
+        return out
+
+    @staticmethod
+    def l2_answer(prompt: str) -> Dict:
+        return {"feed": [
+            {
+                "ids": [int(number)],
+                "category": L2_CATEGORIES[title_score(title, 'cat') % len(L2_CATEGORIES)],
+                "title_optimized": f"{title}（中文）",
+                "score": 50 + title_score(title, 'l2') // 2,
+                "original_sources": [source],
+                "technical_summary": f"{title} 的技术要点。",
+                "url": url,
+            }
+            for number, title, source, url in L2_LINE.findall(prompt)
+        ]}
+
+    def answer(self, request: Dict) -> str:
+        prompt = request['messages'][-1]['content']
+        out = self.l1_answer(prompt) if 'to filter' in prompt else self.l2_answer(prompt)
+        return json.dumps(out, ensure_ascii=False)
+
+    def _failure(self) -> Optional[int]:
+        with self._lock:
+            if self.rng.random() >= self.error_rate:
+                return None
+            return self.rng.choice((429, 500))
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _sse(self, payload: Dict):
+                data = b"data: " + json.dumps(payload, ensure_ascii=False).encode('utf-8') + b"\n\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                if not self.path.endswith('/chat/completions'):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                failure = server._failure()
+                if failure:
+                    time.sleep(server._delay() / 10)
+                    self._send_json(failure, {"error": {"message": "mock failure", "code": failure}},
+                                    {'Retry-After': '0.1'} if failure == 429 else None)
+                    return
+
+                text = server.answer(request)
+                usage = {
+                    "prompt_tokens": sum(estimate_tokens(m['content']) for m in request['messages']),
+                    "completion_tokens": estimate_tokens(text),
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                delay = server._delay()
+                base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": request['model']}
+
+                if not request.get('stream'):
+                    time.sleep(delay)
+                    self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                        {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                    ]))
+                    return
+
+                # Half the latency before the first token, the rest spread over the stream.
+                pieces = [text[i:i + server.chunk_chars] for i in range(0, len(text), server.chunk_chars)]
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                time.sleep(delay / 2)
+                per_piece = delay / 2 / max(1, len(pieces))
+                chunk = dict(base, object="chat.completion.chunk")
+                for piece in pieces:
+                    self._sse(dict(chunk, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+                    if per_piece >= 0.001:
+                        time.sleep(per_piece)
+                self._sse(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                self._sse(dict(chunk, choices=[], usage=usage))
+                data = b"data: [DONE]\n\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n0\r\n\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        thread.start()
+        return thread
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--feeds", type=int, default=20, help="Number of synthetic feeds")
+    parser.add_argument("--items", type=int, default=50, help="Items per feed at startup")
+    parser.add_argument("--new-per-cycle", type=int, default=5, help="Items each feed publishes per cycle")
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="Share of new items that re-report another feed's story")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Mean seconds per mock LLM response")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="+/- seconds around --llm-latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of LLM requests answered with 429/500")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def serve(args, ready=None, feed_port: int = 0, llm_port: int = 0):
+    """Starts both servers and blocks. ready (a multiprocessing queue) receives (feed urls, LLM base url, advance url)."""
+    feeds = FeedServer(args.feeds, args.items, args.new_per_cycle, args.duplicate_rate, args.seed, port=feed_port)
+    llm = MockLLMServer(args.llm_latency, args.llm_jitter, args.llm_error_rate, seed=args.seed, port=llm_port)
+    feeds.start()
+    llm.start()
+    if ready is not None:
+        ready.put((feeds.urls(), llm.base_url, f"http://127.0.0.1:{feeds.port}/advance"))
+    else:
+        print(f"Feeds:   http://127.0.0.1:{feeds.port}/feed/0..{args.feeds - 1}.xml (POST /advance to publish)")
+        print(f"LLM API: {llm.base_url}")
+        print(f"RSS_FEEDS='{json.dumps(feeds.urls())}'")
+    threading.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--feed-port", type=int, default=8765)
+    parser.add_argument("--llm-port", type=int, default=8766)
+    args = parser.parse_args()
+    try:
+        serve(args, feed_port=args.feed_port, llm_port=args.llm_port)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
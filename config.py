@@ -11,22 +11,66 @@ class ContactConfig(BaseModel):
 class AppConfig:
     # Database
     DB_PATH: str = "data/news.db"
+    DB_CACHE_SIZE_KB: int = int(os.getenv("DB_CACHE_SIZE_KB", "16384")) # SQLite page cache per connection
+    DB_MMAP_SIZE: int = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024))) # Bytes of the DB file to memory-map
+    DB_BUSY_TIMEOUT_SECONDS: float = float(os.getenv("DB_BUSY_TIMEOUT_SECONDS", "30")) # Wait this long on a locked DB
     
     # AI Provider
     AI_BASE_URL: str = os.getenv("AI_BASE_URL", "https://api.openai.com/v1")
     AI_API_KEY: str = os.getenv("AI_API_KEY", "")
     AI_MODEL_L1: str = os.getenv("AI_MODEL_L1", "gpt-4o-mini") # Fast model for L1
     AI_MODEL_L2: str = os.getenv("AI_MODEL_L2", "gpt-4o") # Strong model for L2
+    AI_TIMEOUT_SECONDS: float = float(os.getenv("AI_TIMEOUT_SECONDS", "120")) # Per-request timeout
+    AI_MAX_RETRIES: int = int(os.getenv("AI_MAX_RETRIES", "3")) # Retries on 429/5xx/connection errors
+    AI_RETRY_BASE_SECONDS: float = float(os.getenv("AI_RETRY_BASE_SECONDS", "1.0")) # Backoff cap starts here and doubles
+    AI_RETRY_MAX_SECONDS: float = float(os.getenv("AI_RETRY_MAX_SECONDS", "30"))
+    AI_MAX_CONNECTIONS: int = int(os.getenv("AI_MAX_CONNECTIONS", "16")) # HTTP connection pool size
     MAX_L1_LOOPS: int = int(os.getenv("MAX_L1_LOOPS", "5")) # Number of L1 batches to process per cycle
-    L1_BATCH_SIZE: int = int(os.getenv("L1_BATCH_SIZE", "30"))
+    L1_BATCH_SIZE: int = int(os.getenv("L1_BATCH_SIZE", "30")) # Max items per L1 batch (token budget may send fewer)
     L2_BATCH_SIZE: int = int(os.getenv("L2_BATCH_SIZE", "20")) # Max items to send to L2 at once
+    L1_INPUT_TOKEN_BUDGET: int = int(os.getenv("L1_INPUT_TOKEN_BUDGET", "16000")) # Estimated prompt tokens per L1 request
+    L1_OUTPUT_TOKEN_BUDGET: int = int(os.getenv("L1_OUTPUT_TOKEN_BUDGET", "4000")) # Expected completion tokens per L1 request
+    L1_OUTPUT_TOKENS_PER_ITEM: float = float(os.getenv("L1_OUTPUT_TOKENS_PER_ITEM", "40")) # Starting guess, tuned from observed usage
+    L2_INPUT_TOKEN_BUDGET: int = int(os.getenv("L2_INPUT_TOKEN_BUDGET", "16000"))
+    L2_OUTPUT_TOKEN_BUDGET: int = int(os.getenv("L2_OUTPUT_TOKEN_BUDGET", "8000"))
+    L2_OUTPUT_TOKENS_PER_ITEM: float = float(os.getenv("L2_OUTPUT_TOKENS_PER_ITEM", "250"))
+    L1_MAX_IN_FLIGHT: int = int(os.getenv("L1_MAX_IN_FLIGHT", "4")) # Concurrent L1 batches at the API (halved on 429/timeouts)
+    LLM_CACHE_TTL_HOURS: float = float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) # Cached L1/L2 verdicts expire after this
+    LLM_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000"))
+    AI_MAX_CONSECUTIVE_FAILURES: int = int(os.getenv("AI_MAX_CONSECUTIVE_FAILURES", "5")) # Stop draining a stage for this cycle after N failed batches
+    DEDUP_THRESHOLD: float = float(os.getenv("DEDUP_THRESHOLD", "0.8")) # Estimated Jaccard similarity at which stories are merged before L1
+    DEDUP_WINDOW_HOURS: float = float(os.getenv("DEDUP_WINDOW_HOURS", "72")) # Only match against items fetched this recently
+    MATCH_REQUERY_THRESHOLD: float = float(os.getenv("MATCH_REQUERY_THRESHOLD", "0.2")) # Re-ask for unanswered items when this share of outputs match no input
+    QUEUE_LEASE_SECONDS: float = float(os.getenv("QUEUE_LEASE_SECONDS", "900")) # A claimed L1/L2 batch is reclaimed if not finished within this (crashed worker)
+    RETENTION_FILTERED_HOURS: float = float(os.getenv("RETENTION_FILTERED_HOURS", "72")) # Filtered rows are archived after this (0 = keep forever); never less than DEDUP_WINDOW_HOURS
+    RETENTION_DUPLICATE_HOURS: float = float(os.getenv("RETENTION_DUPLICATE_HOURS", "72")) # Never less than DEDUP_WINDOW_HOURS
+    RETENTION_PROCESSED_HOURS: float = float(os.getenv("RETENTION_PROCESSED_HOURS", "72")) # Never less than RANKING_WINDOW_HOURS
+    RETENTION_DEAD_HOURS: float = float(os.getenv("RETENTION_DEAD_HOURS", "720")) # l1_dead / l2_dead; kept longer so someone can look at them
+    RETENTION_ARCHIVE: bool = os.getenv("RETENTION_ARCHIVE", "true").lower() == "true" # Keep expired rows compressed in news_archive (false = delete)
+    RETENTION_INTERVAL_HOURS: float = float(os.getenv("RETENTION_INTERVAL_HOURS", "6")) # How often retention, vacuum and ANALYZE run (0 = never)
+    QUEUE_MAX_ATTEMPTS: int = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3")) # Failed attempts before an item is dead-lettered (l1_dead / l2_dead)
 
     # Application Logic
-    FETCH_INTERVAL_SECONDS: int = int(os.getenv("FETCH_INTERVAL_SECONDS", "600")) # 10 minutes
+    FETCH_INTERVAL_SECONDS: int = int(os.getenv("FETCH_INTERVAL_SECONDS", "600")) # 10 minutes; starting poll interval per feed, and how often the ranking is refreshed
+    WORKER_IDLE_SECONDS: float = float(os.getenv("WORKER_IDLE_SECONDS", "60")) # --role l1/l2 workers re-check their queue this often without a wake-up signal
     GRAVITY: float = float(os.getenv("GRAVITY", "1.1")) # Gravity factor (Lower = less time decay, 0.8-1.2 recommended for 72h window)
     RANKING_WINDOW_HOURS: int = int(os.getenv("RANKING_WINDOW_HOURS", "72")) # Hours to look back for ranking
     DASHBOARD_OUTPUT_PATH: str = os.getenv("DASHBOARD_OUTPUT_PATH", "data/dashboard.json")
+    DASHBOARD_MAX_ITEMS: int = int(os.getenv("DASHBOARD_MAX_ITEMS", "1000")) # Top items exported from the ranking window (0 = all)
+    SERVE_HOST: str = os.getenv("SERVE_HOST", "127.0.0.1") # Built-in dashboard server (main.py --serve)
+    SERVE_PORT: int = int(os.getenv("SERVE_PORT", "8080"))
+    METRICS_JSON_LOGS: bool = os.getenv("METRICS_JSON_LOGS", "false").lower() == "true" # Also print one JSON line per timed span (metrics are always served at /metrics)
     
+    # Fetching
+    FETCH_CONCURRENCY: int = int(os.getenv("FETCH_CONCURRENCY", "16")) # Max feeds downloaded at once
+    FETCH_PER_HOST_LIMIT: int = int(os.getenv("FETCH_PER_HOST_LIMIT", "2")) # Max concurrent requests to one host
+    FETCH_TIMEOUT_SECONDS: float = float(os.getenv("FETCH_TIMEOUT_SECONDS", "20")) # Per-feed download timeout
+    FEED_MAX_BYTES: int = int(os.getenv("FEED_MAX_BYTES", str(16 * 1024 * 1024))) # Feed bodies are cut off (and parsed up to) here (0 = no cap)
+    FEED_CACHE_PATH: str = os.getenv("FEED_CACHE_PATH", os.path.join(os.path.dirname(DB_PATH), "feed_cache.json")) # ETag/Last-Modified validators
+    SEEN_URLS_MAX_ENTRIES: int = int(os.getenv("SEEN_URLS_MAX_ENTRIES", "200000")) # Recent canonical URLs kept in memory to drop known items before the DB
+    FEED_MIN_INTERVAL_SECONDS: float = float(os.getenv("FEED_MIN_INTERVAL_SECONDS", "60")) # Fastest any feed is polled (servers may ask for slower)
+    FEED_MAX_INTERVAL_SECONDS: float = float(os.getenv("FEED_MAX_INTERVAL_SECONDS", "21600")) # Slowest poll for idle feeds (6 hours)
+
     # Sources
     RSS_FEEDS: List[str] = [
         "https://spaceflightnow.com/feed/",
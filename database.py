@@ -1,135 +1,839 @@
+import os
 import sqlite3
 import json
+import threading
 import time
-from typing import List, Dict, Optional, Any
+import weakref
+import zlib
+from typing import List, Dict, Optional, Any, Iterable, Iterator, NamedTuple
 from config import config
+from sources.urls import url_key, url_hash
+
+# Hot pipeline queries. Kept here so debug_db.py can check their query plans.
+SQL_PENDING = "SELECT * FROM news WHERE status = 'pending' AND cluster_id IS NOT NULL LIMIT ?"
+SQL_L1_PASSED = "SELECT * FROM news WHERE status = 'l1_done' AND l1_score >= ? LIMIT ?"
+SQL_PROCESSED = "SELECT * FROM news WHERE status = 'processed' ORDER BY published_at DESC LIMIT ?"
+SQL_RANKING = "SELECT id, l2_score, published_at FROM news WHERE status = 'processed' AND published_at > ? ORDER BY published_at DESC"
+SQL_UNCLUSTERED = (
+    "SELECT id FROM news WHERE status = 'pending' AND cluster_id IS NULL"
+    " AND (lease_until IS NULL OR lease_until < ?) ORDER BY id LIMIT ?"
+)
+
+# name -> (sql, sample params)
+HOT_QUERIES = {
+    'get_pending_news': (SQL_PENDING, (20,)),
+    'get_high_score_pending_l2': (SQL_L1_PASSED, (70, 20)),
+    'get_processed_news': (SQL_PROCESSED, (50,)),
+    'iter_ranking_rows': (SQL_RANKING, (0.0,)),
+    'claim_unclustered': (SQL_UNCLUSTERED, (0.0, 5000)),
+}
+
+def _backfill_url_keys(conn: sqlite3.Connection):
+    # The oldest row keeps each key; later rows that only differ by tracking
+    # parameters, scheme etc. get none, so the UNIQUE index can be built.
+    seen = set()
+    updates = []
+    for news_id, url in conn.execute("SELECT id, url FROM news ORDER BY id"):
+        key = url_key(url)
+        if key not in seen:
+            seen.add(key)
+            updates.append((key, news_id))
+    conn.executemany("UPDATE news SET url_key = ? WHERE id = ?", updates)
+
+# Schema migrations, applied in order on startup and tracked in PRAGMA user_version.
+# Migration N (1-based) is a list of SQL statements or callables taking the connection.
+# Append new entries; never edit one that has already shipped.
+MIGRATIONS: List[List[Any]] = [
+    # 1: Indexes for the status-driven pipeline queries
+    [
+        "CREATE INDEX IF NOT EXISTS idx_news_status_published ON news(status, published_at)",
+        "CREATE INDEX IF NOT EXISTS idx_news_status_l1_score ON news(status, l1_score)",
+    ],
+    # 2: Claim timestamp so concurrent L1 workers never take the same rows
+    [
+        "ALTER TABLE news ADD COLUMN claimed_at REAL",
+    ],
+    # 3: Content-addressed cache of per-item LLM verdicts
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            stage TEXT NOT NULL,
+            verdict TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)",
+    ],
+    # 4: Near-duplicate clustering (MinHash signature per item + persisted LSH band index)
+    [
+        "ALTER TABLE news ADD COLUMN minhash BLOB",
+        "ALTER TABLE news ADD COLUMN cluster_id INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_news_cluster ON news(cluster_id)",
+        '''
+        CREATE TABLE IF NOT EXISTS news_lsh (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            news_id INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_news_lsh_bucket ON news_lsh(band, bucket)",
+        "CREATE INDEX IF NOT EXISTS idx_news_lsh_news ON news_lsh(news_id)",
+    ],
+    # 5: Leased work queue (lease expiry, attempt counter, dead-lettering)
+    [
+        "ALTER TABLE news ADD COLUMN lease_until REAL",
+        "ALTER TABLE news ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE news ADD COLUMN last_error TEXT",
+        "UPDATE news SET status = 'pending', claimed_at = NULL WHERE status = 'l1_running'",
+    ],
+    # 6: Wake-up signals between stage workers (main.py --role)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS signals (
+            name TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+    ],
+    # 7: Per-feed adaptive poll schedule
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS feed_state (
+            url TEXT PRIMARY KEY,
+            interval_seconds REAL NOT NULL,
+            next_poll_at REAL NOT NULL DEFAULT 0,
+            server_min_interval REAL NOT NULL DEFAULT 0,
+            last_polled_at REAL,
+            last_new_at REAL,
+            errors INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+    ],
+    # 8: Canonical URL key (sources/urls.py), unique so variants of one link are stored once
+    [
+        "ALTER TABLE news ADD COLUMN url_key TEXT",
+        _backfill_url_keys,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_news_url_key ON news(url_key)",
+    ],
+    # 9: Retention (processors/retention.py): compressed archive of expired rows,
+    # and the url_key hashes of every row ever removed so they are not re-ingested
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS news_archive (
+            id INTEGER PRIMARY KEY,
+            status TEXT,
+            archived_at REAL NOT NULL,
+            data BLOB NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS url_hashes (
+            hash INTEGER PRIMARY KEY,
+            removed_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_news_status_fetched ON news(status, fetched_at)",
+    ],
+    # 10: Ranking reads only (status, published_at, l2_score), so it is served from
+    # the index without touching table pages. Supersedes idx_news_status_published.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_news_ranking ON news(status, published_at, l2_score)",
+        "DROP INDEX IF EXISTS idx_news_status_published",
+    ],
+    # 11: Newest entry date stored per feed, so parsing can stop at known entries
+    [
+        "ALTER TABLE feed_state ADD COLUMN newest_published_at REAL",
+    ],
+    # 12: Per-feed high-water mark (GUIDs of the last poll) and last fetch stats
+    [
+        "ALTER TABLE feed_state ADD COLUMN seen_guids TEXT", # JSON list of url_hash(guid), newest first
+        "ALTER TABLE feed_state ADD COLUMN late_entries INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE feed_state ADD COLUMN polls_since_full INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE feed_state ADD COLUMN last_items INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE feed_state ADD COLUMN last_new_items INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE feed_state ADD COLUMN last_skipped INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE feed_state ADD COLUMN last_bytes INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE feed_state ADD COLUMN last_latency REAL",
+    ],
+    # 13: One LSH row per (item, band), so a clustering pass that runs twice cannot
+    # duplicate an item's buckets. Supersedes idx_news_lsh_news.
+    [
+        "DELETE FROM news_lsh WHERE rowid NOT IN (SELECT MIN(rowid) FROM news_lsh GROUP BY news_id, band)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_news_lsh_news_band ON news_lsh(news_id, band)",
+        "DROP INDEX IF EXISTS idx_news_lsh_news",
+    ],
+]
+
+# Columns left out of news_archive rows: the dedup signature is only useful while fresh.
+ARCHIVE_SKIP_COLUMNS = ('minhash', 'lease_until', 'claimed_at')
+
+# Work queue stages: stage -> (ready status, running status, dead-letter status)
+QUEUE_STAGES = {
+    'l1': ('pending', 'l1_running', 'l1_dead'),
+    'l2': ('l1_done', 'l2_running', 'l2_dead'),
+}
+# Extra condition on claimable rows: L1 only takes items the deduplicator has clustered
+QUEUE_CLAIMABLE = {
+    'l1': 'cluster_id IS NOT NULL',
+    'l2': '1',
+}
+
+class RankRow(NamedTuple):
+    """The columns ranking needs; the rest of a row is loaded only for exported items."""
+    id: int
+    l2_score: Optional[int]
+    published_at: Optional[float]
+
+class _ThreadConnection:
+    """
+    Holds one thread's connection in threading.local. When the thread exits
+    its locals are dropped and the finalizer closes the connection, so
+    short-lived pool threads do not leak file handles, cache or mmap.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.closer = weakref.finalize(self, conn.close)
 
 class Database:
+    """
+    SQLite access layer.
+
+    Connections are long-lived and owned by one thread each (threading.local),
+    so statements stay cached between calls and no connection is ever shared
+    across threads. A thread's connection is closed when the thread exits.
+    The database runs in WAL mode, which lets any number of readers (see
+    connect_readonly) work alongside the single writer.
+    """
+
     def __init__(self, db_path: str = config.DB_PATH):
         self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections: "weakref.WeakSet[_ThreadConnection]" = weakref.WeakSet() # Live threads' connections
+        self._connections_lock = threading.Lock()
         self._init_db()
 
-    def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+    def _configure(self, conn: sqlite3.Connection):
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous = NORMAL") # Safe with WAL, avoids an fsync per commit
+        conn.execute(f"PRAGMA cache_size = -{config.DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {config.DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread is off only so close() can shut down connections
+        # opened by other threads; each connection is still used by one thread.
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=config.DB_BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        self._configure(conn)
+        return conn
+
+    def _get_conn(self) -> sqlite3.Connection:
+        """Returns this thread's connection, opening it on first use."""
+        holder = getattr(self._local, 'conn', None)
+        if holder is None:
+            holder = _ThreadConnection(self._connect())
+            self._local.conn = holder
+            with self._connections_lock:
+                self._connections.add(holder)
+        return holder.conn
+
+    def connect_readonly(self) -> sqlite3.Connection:
+        """
+        Opens a new read-only connection (caller owns and closes it).
+        Safe to use from another thread or process while the pipeline writes.
+        """
+        uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=config.DB_BUSY_TIMEOUT_SECONDS)
+        self._configure(conn)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def close(self):
+        """Closes every connection opened through this instance."""
+        with self._connections_lock:
+            holders, self._connections = list(self._connections), weakref.WeakSet()
+        for holder in holders:
+            holder.closer()
+        self._local = threading.local()
 
     def _init_db(self):
         conn = self._get_conn()
-        cursor = conn.cursor()
-        
+        # Only takes effect on a new file; existing ones are converted by maintain().
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL is persistent in the database file; readers no longer block the writer.
+        conn.execute("PRAGMA journal_mode = WAL")
+
         # News table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS news (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT UNIQUE NOT NULL,
-                title TEXT,
-                source_name TEXT,
-                published_at REAL,
-                fetched_at REAL,
-                
-                -- L1 Analysis
-                l1_score INTEGER DEFAULT 0,
-                l1_reason TEXT,
-                
-                -- L2 Analysis
-                l2_score INTEGER DEFAULT 0,
-                l2_summary TEXT,
-                l2_title_zh TEXT,
-                category TEXT,
-                
-                -- Status
-                status TEXT DEFAULT 'pending' -- pending, filtered, processed
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS news (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT UNIQUE NOT NULL,
+                    title TEXT,
+                    source_name TEXT,
+                    published_at REAL,
+                    fetched_at REAL,
+
+                    -- L1 Analysis
+                    l1_score INTEGER DEFAULT 0,
+                    l1_reason TEXT,
+
+                    -- L2 Analysis
+                    l2_score INTEGER DEFAULT 0,
+                    l2_summary TEXT,
+                    l2_title_zh TEXT,
+                    category TEXT,
+
+                    -- Status
+                    status TEXT DEFAULT 'pending' -- pending, filtered, processed, duplicate (+ queue states, see QUEUE_STAGES)
+                )
+            ''')
+
+        self._migrate(conn)
+
+    def schema_version(self) -> int:
+        return self._get_conn().execute("PRAGMA user_version").fetchone()[0]
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """Applies pending MIGRATIONS, one transaction per version."""
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
+        # BEGIN IMMEDIATE takes the write lock, so concurrent processes migrate once.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number in range(version + 1, len(MIGRATIONS) + 1):
+                for step in MIGRATIONS[number - 1]:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version = {number}")
+                print(f"Database: Applied schema migration {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def explain(self, sql: str, params: tuple = ()) -> List[str]:
+        """Returns the EXPLAIN QUERY PLAN detail lines for a query."""
+        rows = self._get_conn().execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        return [row['detail'] for row in rows]
 
     def add_news(self, url: str, title: str, source_name: str, published_at: float) -> bool:
         """Returns True if added, False if already exists."""
         conn = self._get_conn()
-        cursor = conn.cursor()
         try:
-            cursor.execute('''
-                INSERT INTO news (url, title, source_name, published_at, fetched_at, status)
-                VALUES (?, ?, ?, ?, ?, 'pending')
-            ''', (url, title, source_name, published_at, time.time()))
-            conn.commit()
+            with conn:
+                conn.execute('''
+                    INSERT INTO news (url, title, source_name, published_at, fetched_at, status)
+                    VALUES (?, ?, ?, ?, ?, 'pending')
+                ''', (url, title, source_name, published_at, time.time()))
             return True
         except sqlite3.IntegrityError:
             return False
-        finally:
-            conn.close()
+
+    def add_news_bulk(self, items: Iterable[Dict]) -> int:
+        """
+        Inserts many items in a single transaction.
+        Each item needs url, title, source_name, published_at (url_key and
+        minhash optional). Existing URLs or url_keys are skipped (INSERT OR
+        IGNORE), and so are url_keys whose row was removed by retention.
+        Returns number of new rows.
+        """
+        now = time.time()
+        rows = [
+            (item['url'], item.get('url_key'), item['title'], item['source_name'], item['published_at'], now,
+             item.get('minhash'), url_hash(item['url_key']) if item.get('url_key') else None)
+            for item in items
+        ]
+        if not rows:
+            return 0
+        conn = self._get_conn()
+        before = conn.total_changes
+        with conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO news (url, url_key, title, source_name, published_at, fetched_at, minhash, status)
+                SELECT ?, ?, ?, ?, ?, ?, ?, 'pending'
+                WHERE NOT EXISTS (SELECT 1 FROM url_hashes WHERE hash = ?)
+            ''', rows)
+        return conn.total_changes - before
+
+    def recent_url_keys(self, limit: int) -> List[str]:
+        """url_keys of the newest `limit` rows, oldest first (warms SeenUrls)."""
+        conn = self._get_conn()
+        rows = conn.execute(
+            "SELECT url_key FROM news WHERE url_key IS NOT NULL ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [row['url_key'] for row in reversed(rows)]
 
     def get_pending_news(self, limit: int = 20) -> List[Dict]:
+        """Pending items the deduplicator has clustered (only those are claimable by L1)."""
         conn = self._get_conn()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM news WHERE status = 'pending' LIMIT ?", (limit,))
-        rows = cursor.fetchall()
-        conn.close()
+        rows = conn.execute(SQL_PENDING, (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def _expire_leases(self, conn: sqlite3.Connection, stage: str, now: float) -> int:
+        # Rows whose worker died (or hung past its lease) go back to the queue,
+        # or to the dead-letter status once they used up their attempts.
+        ready, running, dead = QUEUE_STAGES[stage]
+        return conn.execute('''
+            UPDATE news SET
+                status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                claimed_at = NULL, lease_until = NULL, last_error = 'lease expired'
+            WHERE status = ? AND lease_until < ?
+        ''', (config.QUEUE_MAX_ATTEMPTS, dead, ready, running, now)).rowcount
+
+    def reclaim_expired(self, stage: str) -> int:
+        """
+        Returns rows of a stage whose lease expired (crashed or hung worker) to
+        its queue. Call before peeking at the queue: claim() does it too, but
+        is never reached while the queue looks empty.
+        """
+        conn = self._get_conn()
+        with conn:
+            expired = self._expire_leases(conn, stage, time.time())
+        if expired:
+            print(f"Queue: {expired} expired {stage.upper()} leases returned to the queue.")
+        return expired
+
+    def claim(self, stage: str, limit: int = 20, ids: Optional[List[int]] = None,
+              lease_seconds: float = config.QUEUE_LEASE_SECONDS) -> List[Dict]:
+        """
+        Leases up to `limit` ready rows of a stage (or the given ids, if still
+        ready) to the caller and returns them. A single UPDATE ... RETURNING,
+        so two workers (threads or processes) can never claim the same row.
+        Every claim counts as an attempt. Expired leases are reclaimed first.
+        """
+        ready, running, _ = QUEUE_STAGES[stage]
+        claimable = QUEUE_CLAIMABLE[stage]
+        conn = self._get_conn()
+        now = time.time()
+        with conn:
+            expired = self._expire_leases(conn, stage, now)
+            if expired:
+                print(f"Queue: {expired} expired {stage.upper()} leases returned to the queue.")
+            if ids is not None:
+                if not ids:
+                    return []
+                placeholders = ','.join('?' for _ in ids)
+                rows = conn.execute(f'''
+                    UPDATE news SET status = ?, claimed_at = ?, lease_until = ?, attempts = attempts + 1
+                    WHERE id IN ({placeholders}) AND status = ? AND {claimable}
+                    RETURNING *
+                ''', (running, now, now + lease_seconds, *ids, ready)).fetchall()
+            else:
+                rows = conn.execute(f'''
+                    UPDATE news SET status = ?, claimed_at = ?, lease_until = ?, attempts = attempts + 1
+                    WHERE id IN (SELECT id FROM news WHERE status = ? AND {claimable} LIMIT ?)
+                    RETURNING *
+                ''', (running, now, now + lease_seconds, ready, limit)).fetchall()
+        return sorted((dict(row) for row in rows), key=lambda row: row['id'])
+
+    def release(self, stage: str, news_ids: List[int], error: Optional[str] = None, count_attempt: bool = True):
+        """
+        Ends the lease on rows that were claimed but not finished. They go back
+        to the stage's ready status, or to its dead-letter status after
+        QUEUE_MAX_ATTEMPTS attempts. With count_attempt=False (e.g. rate
+        limits, which are not the item's fault) the attempt is given back.
+        """
+        if not news_ids:
+            return
+        ready, running, dead = QUEUE_STAGES[stage]
+        conn = self._get_conn()
+        with conn:
+            if not count_attempt:
+                conn.executemany(
+                    "UPDATE news SET attempts = MAX(attempts - 1, 0) WHERE id = ? AND status = ?",
+                    [(news_id, running) for news_id in news_ids]
+                )
+            conn.executemany('''
+                UPDATE news SET
+                    status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                    claimed_at = NULL, lease_until = NULL, last_error = COALESCE(?, last_error)
+                WHERE id = ? AND status = ?
+            ''', [(config.QUEUE_MAX_ATTEMPTS, dead, ready, error, news_id, running) for news_id in news_ids])
+
+    def get_dead_letters(self, limit: int = 100) -> List[Dict]:
+        """Rows that exhausted their attempts in any stage."""
+        conn = self._get_conn()
+        dead = [stage_statuses[2] for stage_statuses in QUEUE_STAGES.values()]
+        placeholders = ','.join('?' for _ in dead)
+        rows = conn.execute(
+            f"SELECT id, title, status, attempts, last_error FROM news WHERE status IN ({placeholders}) LIMIT ?",
+            (*dead, limit)
+        ).fetchall()
         return [dict(row) for row in rows]
 
+    def requeue_dead_letters(self) -> int:
+        """Puts every dead-lettered row back into its stage's queue with fresh attempts."""
+        conn = self._get_conn()
+        requeued = 0
+        with conn:
+            for ready, _, dead in QUEUE_STAGES.values():
+                requeued += conn.execute(
+                    "UPDATE news SET status = ?, attempts = 0, last_error = NULL WHERE status = ?", (ready, dead)
+                ).rowcount
+        return requeued
+
     def update_l1_result(self, news_id: int, score: int, reason: str, status: str):
+        self.update_l1_results([(news_id, score, reason, status)])
+
+    def update_l1_results(self, results: List[tuple]):
+        """Applies (news_id, score, reason, status) rows in one transaction."""
+        if not results:
+            return
         conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE news 
-            SET l1_score = ?, l1_reason = ?, status = ?
-            WHERE id = ?
-        ''', (score, reason, status, news_id))
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.executemany('''
+                UPDATE news
+                SET l1_score = ?, l1_reason = ?, status = ?,
+                    claimed_at = NULL, lease_until = NULL, attempts = 0, last_error = NULL
+                WHERE id = ?
+            ''', [(score, reason, status, news_id) for news_id, score, reason, status in results])
+            conn.executemany(
+                "UPDATE news SET l1_score = ?, l1_reason = ? WHERE cluster_id = ? AND status = 'duplicate'",
+                [(score, reason, news_id) for news_id, score, reason, _ in results]
+            )
 
     def get_high_score_pending_l2(self, min_score: int = 70, limit: int = 20) -> List[Dict]:
         """Get news that passed L1 but haven't been processed by L2 yet."""
         conn = self._get_conn()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
         # We define a temporary status 'l1_passed' or just check if score is high and l2_score is 0/default?
         # Let's rely on 'status' being 'filtered' if it failed.
         # Use a new L2 check: if status='processed' check if l2 is done?
         # Actually simplest is: Status='pending' -> L1 -> Status='filtered' (if fail) OR 'l1_done' (if success)
         # Then L2 picks up 'l1_done' -> Status='processed'
-        
+
         # Let's adjust status logic in code.
         # But for now, let's look for "l1_done" status.
-        cursor.execute("SELECT * FROM news WHERE status = 'l1_done' AND l1_score >= ? LIMIT ?", (min_score, limit))
-        rows = cursor.fetchall()
-        conn.close()
+        rows = conn.execute(SQL_L1_PASSED, (min_score, limit)).fetchall()
         return [dict(row) for row in rows]
 
     def update_l2_result(self, news_id: int, score: int, summary: str, title_zh: str, category: str):
+        self.update_l2_results([(news_id, score, summary, title_zh, category)])
+
+    def update_l2_results(self, results: List[tuple], merged: Optional[List[tuple]] = None,
+                          filtered: Optional[List[int]] = None):
+        """
+        Applies (news_id, score, summary, title_zh, category) rows in one transaction.
+        merged holds (news_id, representative_id) pairs for items the model folded
+        into another entry; they (and their own duplicates) join the representative's
+        cluster as 'duplicate' and receive its result.
+        filtered holds ids the model left out as low-value; they become 'filtered'.
+        """
+        if not results and not merged and not filtered:
+            return
         conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE news 
-            SET l2_score = ?, l2_summary = ?, l2_title_zh = ?, category = ?, status = 'processed'
-            WHERE id = ?
-        ''', (score, summary, title_zh, category, news_id))
-        conn.commit()
-        conn.close()
+        rows = [(score, summary, title_zh, category, news_id) for news_id, score, summary, title_zh, category in results]
+        with conn:
+            if filtered:
+                conn.executemany('''
+                    UPDATE news SET status = 'filtered', l2_score = 0, claimed_at = NULL, lease_until = NULL,
+                        attempts = 0, last_error = NULL
+                    WHERE id = ?
+                ''', [(news_id,) for news_id in filtered])
+            if merged:
+                conn.executemany(
+                    "UPDATE news SET cluster_id = ? WHERE cluster_id = ? OR id = ?",
+                    [(representative, news_id, news_id) for news_id, representative in merged]
+                )
+                conn.executemany(
+                    "UPDATE news SET status = 'duplicate', claimed_at = NULL, lease_until = NULL WHERE id = ?",
+                    [(news_id,) for news_id, _ in merged]
+                )
+            conn.executemany('''
+                UPDATE news
+                SET l2_score = ?, l2_summary = ?, l2_title_zh = ?, category = ?, status = 'processed',
+                    claimed_at = NULL, lease_until = NULL, attempts = 0, last_error = NULL
+                WHERE id = ?
+            ''', rows)
+            conn.executemany('''
+                UPDATE news SET l2_score = ?, l2_summary = ?, l2_title_zh = ?, category = ?
+                WHERE cluster_id = ? AND status = 'duplicate'
+            ''', rows)
 
     def get_processed_news(self, limit: int = 50) -> List[Dict]:
         conn = self._get_conn()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM news WHERE status = 'processed' ORDER BY published_at DESC LIMIT ?", (limit,))
-        rows = cursor.fetchall()
-        conn.close()
+        rows = conn.execute(SQL_PROCESSED, (limit,)).fetchall()
         return [dict(row) for row in rows]
-        
-    def get_conn(self):
-        return self._get_conn()
 
-    def get_recent_processed_news(self, hours: int = config.RANKING_WINDOW_HOURS) -> List[Dict]:
-        """Get all processed news from the last N hours."""
+    def claim_unclustered(self, limit: int = 5000, lease_seconds: float = config.QUEUE_LEASE_SECONDS) -> List[Dict]:
+        """
+        Leases up to `limit` pending rows not yet assigned to a near-duplicate
+        cluster, oldest first, so concurrent L1 workers cluster disjoint rows.
+        save_clusters ends the lease; a crashed worker's rows are taken again
+        once it expires.
+        """
         conn = self._get_conn()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cutoff = time.time() - (hours * 3600)
-        cursor.execute("SELECT * FROM news WHERE status = 'processed' AND published_at > ? ORDER BY published_at DESC", (cutoff,))
-        rows = cursor.fetchall()
-        conn.close()
+        now = time.time()
+        with conn:
+            rows = conn.execute(f'''
+                UPDATE news SET lease_until = ?
+                WHERE id IN ({SQL_UNCLUSTERED})
+                RETURNING id, title, minhash
+            ''', (now + lease_seconds, now, limit)).fetchall()
+        return sorted((dict(row) for row in rows), key=lambda row: row['id'])
+
+    def get_lsh_candidates(self, buckets: List[int], exclude_id: int, window_hours: float) -> List[Dict]:
+        """Rows fetched in the last window_hours that share at least one LSH bucket."""
+        if not buckets:
+            return []
+        conn = self._get_conn()
+        pairs = ' OR '.join('(l.band = ? AND l.bucket = ?)' for _ in buckets)
+        params = [value for band, bucket in enumerate(buckets) for value in (band, bucket)]
+        rows = conn.execute(f'''
+            SELECT DISTINCT n.id, n.cluster_id, n.minhash FROM news_lsh l
+            JOIN news n ON n.id = l.news_id
+            WHERE ({pairs}) AND n.id != ? AND n.fetched_at > ?
+        ''', (*params, exclude_id, time.time() - window_hours * 3600)).fetchall()
         return [dict(row) for row in rows]
 
+    def save_clusters(self, assignments: List[tuple]):
+        """
+        Stores (news_id, cluster_id, buckets, minhash) rows in one transaction.
+        Rows joining another item's cluster become 'duplicate' and take over
+        whatever verdict the representative already has; the others stay
+        'pending' as the representative of their own cluster. Rows another
+        worker clustered meanwhile (after an expired lease) keep its result.
+        """
+        if not assignments:
+            return
+        conn = self._get_conn()
+        with conn:
+            conn.executemany(
+                "UPDATE news SET cluster_id = ?, minhash = COALESCE(minhash, ?), lease_until = NULL WHERE id = ? AND cluster_id IS NULL",
+                [(cluster_id, minhash, news_id) for news_id, cluster_id, _, minhash in assignments]
+            )
+            conn.executemany('''
+                UPDATE news SET status = 'duplicate',
+                    l1_score = rep.l1_score, l1_reason = rep.l1_reason,
+                    l2_score = rep.l2_score, l2_summary = rep.l2_summary,
+                    l2_title_zh = rep.l2_title_zh, category = rep.category
+                FROM (SELECT * FROM news WHERE id = ?) AS rep
+                WHERE news.id = ? AND news.status = 'pending' AND news.cluster_id = rep.id
+            ''', [(cluster_id, news_id) for news_id, cluster_id, _, _ in assignments if cluster_id != news_id])
+            conn.executemany(
+                "INSERT OR IGNORE INTO news_lsh (band, bucket, news_id) VALUES (?, ?, ?)",
+                [(band, bucket, news_id) for news_id, _, buckets, _ in assignments for band, bucket in enumerate(buckets)]
+            )
+
+    def archive_expired(self, status: str, cutoff: float, archive: bool = True, limit: int = 5000) -> int:
+        """
+        Removes up to `limit` rows with this status fetched before cutoff, in one
+        transaction. Each row is kept as zlib-compressed JSON in news_archive
+        (unless archive=False), and its url_key hash goes into url_hashes so
+        the feed entry is never ingested again. Returns the number removed.
+        """
+        conn = self._get_conn()
+        now = time.time()
+        with conn:
+            rows = conn.execute(
+                "SELECT * FROM news WHERE status = ? AND fetched_at < ? LIMIT ?", (status, cutoff, limit)
+            ).fetchall()
+            if not rows:
+                return 0
+            ids = [row['id'] for row in rows]
+            if archive:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO news_archive (id, status, archived_at, data) VALUES (?, ?, ?, ?)",
+                    [
+                        (row['id'], row['status'], now, zlib.compress(json.dumps(
+                            {name: row[name] for name in row.keys() if name not in ARCHIVE_SKIP_COLUMNS},
+                            ensure_ascii=False, separators=(',', ':')
+                        ).encode('utf-8')))
+                        for row in rows
+                    ]
+                )
+            conn.executemany(
+                "INSERT OR IGNORE INTO url_hashes (hash, removed_at) VALUES (?, ?)",
+                [(url_hash(row['url_key'] or url_key(row['url'])), now) for row in rows]
+            )
+            placeholders = ','.join('?' for _ in ids)
+            conn.execute(f"DELETE FROM news_lsh WHERE news_id IN ({placeholders})", ids)
+            conn.execute(f"DELETE FROM news WHERE id IN ({placeholders})", ids)
+        return len(ids)
+
+    def get_archived(self, news_id: int) -> Optional[Dict]:
+        """An archived row, decompressed, or None."""
+        row = self._get_conn().execute("SELECT data FROM news_archive WHERE id = ?", (news_id,)).fetchone()
+        return json.loads(zlib.decompress(row['data'])) if row else None
+
+    def compact_dedup_index(self, cutoff: float) -> int:
+        """
+        Drops the LSH buckets and MinHash signatures of rows fetched before
+        cutoff; clustering never looks that far back. Returns rows compacted.
+        """
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                "DELETE FROM news_lsh WHERE news_id IN (SELECT id FROM news WHERE fetched_at < ? AND minhash IS NOT NULL)",
+                (cutoff,)
+            )
+            # Pending rows still need theirs to be clustered.
+            return conn.execute(
+                "UPDATE news SET minhash = NULL WHERE fetched_at < ? AND minhash IS NOT NULL AND status != 'pending'",
+                (cutoff,)
+            ).rowcount
+
+    def maintain(self) -> Dict[str, int]:
+        """
+        Returns freed pages to the filesystem (incremental vacuum), refreshes
+        planner statistics (bounded ANALYZE) and truncates the WAL. A database
+        created before auto_vacuum was enabled is converted once with a full VACUUM.
+        """
+        conn = self._get_conn()
+        stats = {'converted': 0}
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            stats['converted'] = 1
+        stats['freed_pages'] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        stats['pages'] = conn.execute("PRAGMA page_count").fetchone()[0]
+        return stats
+
+    def get_cached_verdicts(self, keys: List[str]) -> Dict[str, Dict]:
+        """Returns {key: verdict} for the cache keys that are present."""
+        if not keys:
+            return {}
+        conn = self._get_conn()
+        placeholders = ','.join('?' for _ in keys)
+        rows = conn.execute(f"SELECT key, verdict FROM llm_cache WHERE key IN ({placeholders})", keys).fetchall()
+        return {row['key']: json.loads(row['verdict']) for row in rows}
+
+    def put_cached_verdicts(self, rows: List[tuple]):
+        """Stores (key, stage, verdict_json) rows, replacing older entries."""
+        if not rows:
+            return
+        now = time.time()
+        conn = self._get_conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO llm_cache (key, stage, verdict, created_at) VALUES (?, ?, ?, ?)",
+                [(key, stage, verdict, now) for key, stage, verdict in rows]
+            )
+
+    def evict_cached_verdicts(self, ttl_seconds: float, max_entries: int) -> int:
+        """Deletes expired cache rows, then the oldest ones above max_entries. Returns rows deleted."""
+        conn = self._get_conn()
+        with conn:
+            deleted = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - ttl_seconds,)).rowcount
+            deleted += conn.execute('''
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (max_entries,)).rowcount
+        return deleted
+
+    def get_feed_states(self) -> Dict[str, Dict]:
+        """Returns {url: feed_state row} for every feed with a stored schedule (seen_guids as a list)."""
+        rows = self._get_conn().execute("SELECT * FROM feed_state").fetchall()
+        states = {}
+        for row in rows:
+            state = dict(row)
+            state['seen_guids'] = json.loads(state['seen_guids'] or '[]')
+            states[row['url']] = state
+        return states
+
+    def save_feed_states(self, states: List[Dict]):
+        """Upserts feed_state rows (dicts with the table's columns, seen_guids as a list)."""
+        if not states:
+            return
+        rows = [dict(state, seen_guids=json.dumps(state['seen_guids'])) for state in states]
+        conn = self._get_conn()
+        with conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO feed_state
+                    (url, interval_seconds, next_poll_at, server_min_interval, last_polled_at, last_new_at, errors,
+                     newest_published_at, seen_guids, late_entries, polls_since_full,
+                     last_items, last_new_items, last_skipped, last_bytes, last_latency)
+                VALUES (:url, :interval_seconds, :next_poll_at, :server_min_interval, :last_polled_at, :last_new_at, :errors,
+                        :newest_published_at, :seen_guids, :late_entries, :polls_since_full,
+                        :last_items, :last_new_items, :last_skipped, :last_bytes, :last_latency)
+            ''', rows)
+
+    def notify(self, name: str):
+        """Raises a wake-up signal for workers waiting on `name` (any process)."""
+        conn = self._get_conn()
+        with conn:
+            conn.execute('''
+                INSERT INTO signals (name, seq, updated_at) VALUES (?, 1, ?)
+                ON CONFLICT(name) DO UPDATE SET seq = seq + 1, updated_at = excluded.updated_at
+            ''', (name, time.time()))
+
+    def signal_seq(self, name: str) -> int:
+        row = self._get_conn().execute("SELECT seq FROM signals WHERE name = ?", (name,)).fetchone()
+        return row['seq'] if row else 0
+
+    def wait_for_signal(self, name: str, seen_seq: int, timeout: float, poll_interval: float = 0.25) -> int:
+        """
+        Blocks until signal `name` moves past seen_seq or timeout expires, and
+        returns its current sequence number. Between checks it only reads
+        PRAGMA data_version, which changes when another connection commits,
+        so idle waiting costs no table reads.
+        """
+        conn = self._get_conn()
+        deadline = time.monotonic() + timeout
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        seq = self.signal_seq(name)
+        while seq <= seen_seq:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(poll_interval, remaining))
+            current = conn.execute("PRAGMA data_version").fetchone()[0]
+            if current != version:
+                version = current
+                seq = self.signal_seq(name)
+        return seq
+
+    def status_counts(self) -> Dict[str, int]:
+        """Number of news rows per status (queue depth for metrics)."""
+        conn = self._get_conn()
+        return {row['status']: row['n'] for row in conn.execute("SELECT status, COUNT(*) AS n FROM news GROUP BY status")}
+
+    def get_conn(self):
+        """Returns a new read-write connection owned by the caller (close it when done)."""
+        return self._connect()
+
+    def iter_ranking_rows(self, hours: int = config.RANKING_WINDOW_HOURS) -> Iterator[RankRow]:
+        """
+        Streams processed news from the last N hours as RankRow, newest first.
+        Rows come straight off the cursor, so the window is never held in memory.
+        """
+        cursor = self._get_conn().cursor()
+        cursor.row_factory = lambda _, row: RankRow(*row)
+        cursor.execute(SQL_RANKING, (time.time() - hours * 3600,))
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def get_news_fields(self, news_ids: List[int], fields: Iterable[str]) -> Dict[int, Dict]:
+        """Only the given columns of the given rows, keyed by id."""
+        columns = ", ".join(dict.fromkeys(('id',) + tuple(fields)))
+        conn = self._get_conn()
+        found = {}
+        for start in range(0, len(news_ids), 500):
+            chunk = news_ids[start:start + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            for row in conn.execute(f"SELECT {columns} FROM news WHERE id IN ({placeholders})", chunk):
+                found[row['id']] = dict(row)
+        return found
+
 db = Database()
@@ -1,8 +1,9 @@
-from database import db
+from database import db, HOT_QUERIES
+import sys
 import time
 
 def debug_news(ids):
-    conn = db.get_conn()
+    conn = db.connect_readonly()
     cursor = conn.cursor()
     placeholders = ','.join('?' for _ in ids)
     cursor.execute(f"SELECT id, title, published_at, l1_score, l2_score, status, l2_title_zh FROM news WHERE id IN ({placeholders})", ids)
@@ -22,5 +23,63 @@ def debug_news(ids):
         
     conn.close()
 
+def check_query_plans() -> bool:
+    """Prints EXPLAIN QUERY PLAN for the hot pipeline queries. False if any scans the news table."""
+    ok = True
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = db.explain(sql, params)
+        full_scan = any(line.startswith("SCAN news") for line in plan)
+        ok = ok and not full_scan
+        print(f"{'FULL SCAN' if full_scan else 'ok':<9} {name}")
+        for line in plan:
+            print(f"          {line}")
+    return ok
+
+def show_dead_letters():
+    """Lists items that exhausted their L1/L2 attempts."""
+    for row in db.get_dead_letters():
+        print(f"{row['id']:>7} {row['status']:<8} attempts={row['attempts']} {row['title']}")
+        print(f"        last error: {row['last_error']}")
+
+def show_feeds():
+    """Per-feed poll schedule, high-water mark and last fetch stats."""
+    now = time.time()
+    for url, state in sorted(db.get_feed_states().items()):
+        newest = state['newest_published_at']
+        print(url)
+        print(f"    next poll in {(state['next_poll_at'] - now) / 60:.0f}m (every {state['interval_seconds'] / 60:.0f}m), "
+              f"errors={state['errors']}")
+        print(f"    high-water mark: {f'{(now - newest) / 3600:.1f}h ago' if newest else 'none'}, "
+              f"{len(state['seen_guids'])} GUIDs, late entries={state['late_entries']}")
+        print(f"    last fetch: {state['last_items']} items, {state['last_new_items']} new, "
+              f"{state['last_skipped']} skipped, {state['last_bytes'] // 1024} KiB, {state['last_latency'] or 0:.1f}s")
+
+def show_archived(news_id: int):
+    """Prints a row that retention moved to news_archive."""
+    row = db.get_archived(news_id)
+    if row is None:
+        print(f"No archived row {news_id}.")
+        return
+    for name, value in row.items():
+        print(f"{name}: {value}")
+
 if __name__ == "__main__":
+    if "--plans" in sys.argv:
+        sys.exit(0 if check_query_plans() else 1)
+    if "--dead" in sys.argv:
+        show_dead_letters()
+        sys.exit(0)
+    if "--requeue-dead" in sys.argv:
+        print(f"Requeued {db.requeue_dead_letters()} items.")
+        sys.exit(0)
+    if "--feeds" in sys.argv:
+        show_feeds()
+        sys.exit(0)
+    if "--retention" in sys.argv:
+        from processors.retention import retention
+        retention.run()
+        sys.exit(0)
+    if "--archived" in sys.argv:
+        show_archived(int(sys.argv[sys.argv.index("--archived") + 1]))
+        sys.exit(0)
     debug_news([17, 16, 13, 6])
@@ -1,14 +1,21 @@
+import argparse
 import time
 import signal
 import sys
 from datetime import datetime
 from config import config
 from sources.manager import source_manager
+from processors.dedup import deduplicator, CLUSTER_BATCH_SIZE
 from processors.l1_filter import l1_filter
 from processors.l2_scorer import l2_scorer
+from processors.verdict_cache import VerdictCache
+from processors.retention import retention
 from database import db
-from ranking import calculate_gravity_score
-import json
+from ai_service import ai_service, UsageStats
+from ranking import rank_rows
+from output import output_writer, build_dashboard, dashboard_fingerprint, DASHBOARD_FIELDS
+from server import DashboardServer, dashboard_snapshot
+from metrics import metrics
 
 def signal_handler(sig, frame):
     print("\nExiting...")
@@ -44,102 +51,217 @@ def generate_simplified_top5(items: list):
         output_path = "data/top5.json"
         
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(top5, f, ensure_ascii=False, indent=2)
-        print(f"Top 5 saved to {output_path}")
+        if output_writer.write(output_path, top5):
+            print(f"Top 5 saved to {output_path}")
     except Exception as e:
         print(f"Error saving top5.json: {e}")
 
-def calculate_sleep_seconds(interval: int) -> float:
-    """Calculate seconds until next aligned interval."""
-    now = time.time()
-    next_run = (int(now) // interval + 1) * interval
-    return next_run - now
+def sleep_until(seconds: float):
+    seconds = max(1.0, seconds)
+    print(f"Sleeping for {seconds:.1f} seconds (Next run at {datetime.fromtimestamp(time.time() + seconds).strftime('%H:%M:%S')})...")
+    time.sleep(seconds)
+
+# Wake-up signal each stage raises when it produced work for the next one.
+SIGNAL_NEW_ITEMS = 'new_items'
+SIGNAL_L1_DONE = 'l1_done'
+SIGNAL_L2_DONE = 'l2_done'
+
+ROLES = ('all', 'fetch', 'l1', 'l2', 'rank')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="AI AOD News Dashboard")
+    parser.add_argument("--role", choices=ROLES, default="all",
+                        help="Run one pipeline stage as its own worker process (default: all stages in one loop)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Also serve the dashboard over HTTP from memory (worker roles serve only /metrics)")
+    parser.add_argument("--host", default=config.SERVE_HOST, help="Address for --serve")
+    parser.add_argument("--port", type=int, default=config.SERVE_PORT, help="Port for --serve")
+    return parser.parse_args()
+
+def run_fetch() -> int:
+    """Fetches the feeds that are due (see FeedScheduler). Returns the number of new items."""
+    with metrics.span('fetch'):
+        fetch_summary = source_manager.fetch_due()
+    if not fetch_summary.feeds:
+        return 0
+    print(f"Fetched {fetch_summary.new_items} new items. {fetch_summary}")
+    if fetch_summary.new_items:
+        db.notify(SIGNAL_NEW_ITEMS)
+    return fetch_summary.new_items
+
+def run_l1() -> int:
+    """Clusters near-duplicates and drains the L1 queue. Returns items processed."""
+    # Near-duplicate clustering: one representative per story goes to the model
+    # L1 only takes clustered rows, so a backlog is clustered in full, pass by pass
+    with metrics.span('dedup'):
+        while deduplicator.cluster_pending(limit=CLUSTER_BATCH_SIZE) >= CLUSTER_BATCH_SIZE:
+            pass
+
+    # Process ALL pending items, several batches in flight at once
+    print("L1: Starting batch processing...")
+    with metrics.span('l1'):
+        l1_count = l1_filter.process_all(batch_size=config.L1_BATCH_SIZE)
+    print(f"L1: Processed {l1_count} items.")
+    if l1_count:
+        db.notify(SIGNAL_L1_DONE)
+    return l1_count
+
+def run_l2() -> int:
+    """Drains the L2 queue. Returns items processed."""
+    # Process ALL items that passed L1
+    print("L2: Starting batch processing...")
+    total = 0
+    with metrics.span('l2'):
+        while True:
+            count = l2_scorer.process_l1_passed()
+            if count == 0:
+                break
+            total += count
+    if total:
+        db.notify(SIGNAL_L2_DONE)
+    return total
+
+def run_rank():
+    """Ranks recent processed items and writes the dashboard outputs."""
+    # Rank the whole window from (id, score, published_at) alone, then load
+    # the displayed fields (summaries etc.) only for the items that are shown.
+    with metrics.span('rank'):
+        top = rank_rows(db.iter_ranking_rows(hours=config.RANKING_WINDOW_HOURS), config.GRAVITY,
+                        top_k=config.DASHBOARD_MAX_ITEMS or None)
+        items = db.get_news_fields([news_id for news_id, _ in top], DASHBOARD_FIELDS)
+        ranked = [(items[news_id], g_score) for news_id, g_score in top if news_id in items]
+    if not ranked:
+        return
+    header = f"\n=== Top News (Last {config.RANKING_WINDOW_HOURS}h, Gravity={config.GRAVITY}) ==="
+    print(header)
+
+    # Console Output (Top 10)
+    for item, g_score in ranked[:10]:
+        print(f"[{g_score:.1f}] {item['l2_title_zh']} (Original: {item['l2_score']})")
+        print(f"   {item['l2_summary']}")
+        print(f"   URL: {item['url']}")
+        print("")
+
+    # Save JSON (atomic, compact, skipped when the ranking is unchanged)
+    with metrics.span('write'):
+        dashboard = build_dashboard(ranked)
+        dashboard_snapshot.update(dashboard)
+        written = output_writer.write(config.DASHBOARD_OUTPUT_PATH, dashboard, hash_of=dashboard_fingerprint(dashboard))
+    if written:
+        print(f"Dashboard saved to {config.DASHBOARD_OUTPUT_PATH}")
+    else:
+        print("Dashboard unchanged, skipped write.")
+
+    # Generate Simplified Top 5
+    generate_simplified_top5(ranked)
+
+def collect_queue_depth():
+    """Refreshes the queue_items gauges from the news table."""
+    counts = db.status_counts()
+    # Known statuses are always reported, so an emptied queue drops to 0.
+    statuses = {'pending', 'l1_running', 'l1_done', 'l2_running', 'processed', 'filtered', 'duplicate', 'l1_dead', 'l2_dead'}
+    for status in statuses | set(counts):
+        metrics.set_gauge('queue_items', counts.get(status, 0), status=status)
+
+def report_stats(stages=(l1_filter, l2_scorer)):
+    """Prints and resets AI usage and per-stage cache/batching/matching stats."""
+    if metrics.json_logs:
+        # A GROUP BY over the whole table; only worth it when someone reads it.
+        metrics.log('queue', **db.status_counts())
+    print(f"AI usage this cycle: {UsageStats.format(ai_service.usage.reset())}")
+    for stage in stages:
+        print(stage.cache.stats())
+        print(stage.batcher.stats())
+        print(stage.matching.stats())
+        stage.cache.reset_stats()
+        stage.batcher.reset_stats()
+        stage.matching.reset_stats()
+    evicted = VerdictCache.evict()
+    if evicted:
+        print(f"Evicted {evicted} cached verdicts.")
+
+def run_maintenance():
+    """Retention, vacuum and ANALYZE, at most once per RETENTION_INTERVAL_HOURS."""
+    try:
+        retention.run_if_due()
+    except Exception as e:
+        print(f"Retention Error: {e}")
+
+def run_worker(role: str):
+    """
+    Runs one stage forever as its own process. Workers coordinate only through
+    the database: the leased queues hand out work, and each stage raises a
+    wake-up signal that the next stage waits on instead of sleeping blindly.
+    fetch sleeps until the next feed is due; rank also re-runs every
+    FETCH_INTERVAL_SECONDS because gravity scores decay with time, and owns
+    retention/maintenance.
+    """
+    stages = {
+        'fetch': (run_fetch, None, None),
+        'l1': (lambda: (run_l1(), report_stats((l1_filter,))), SIGNAL_NEW_ITEMS, config.WORKER_IDLE_SECONDS),
+        'l2': (lambda: (run_l2(), report_stats((l2_scorer,))), SIGNAL_L1_DONE, config.WORKER_IDLE_SECONDS),
+        'rank': (lambda: (run_rank(), run_maintenance()), SIGNAL_L2_DONE, config.FETCH_INTERVAL_SECONDS),
+    }
+    run, wake_on, idle_timeout = stages[role]
+    print(f"Worker '{role}' started" + (f", waking on '{wake_on}'." if wake_on else "."))
+    while True:
+        seen = db.signal_seq(wake_on) if wake_on else 0
+        try:
+            run()
+        except Exception as e:
+            print(f"Worker '{role}' Error: {e}")
+            time.sleep(min(60, idle_timeout or 60))
+        if wake_on:
+            db.wait_for_signal(wake_on, seen, idle_timeout)
+        else:
+            sleep_until(source_manager.scheduler.seconds_until_next())
 
 def main():
+    args = parse_args()
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
     
     print("AI AOD News Dashboard Started.")
     print(f"Update Interval: {config.FETCH_INTERVAL_SECONDS} seconds")
 
+    metrics.add_collector(collect_queue_depth)
+    if args.serve:
+        if args.role in ('all', 'rank'):
+            dashboard_snapshot.load_file(config.DASHBOARD_OUTPUT_PATH)
+            DashboardServer(dashboard_snapshot, args.host, args.port).start_in_thread()
+        else:
+            DashboardServer(None, args.host, args.port).start_in_thread()
+
+    if args.role != 'all':
+        run_worker(args.role)
+        return
+
+    # Feeds are polled on their own adaptive schedules; the rest of the
+    # pipeline runs as soon as a poll brings new items, and at least every
+    # FETCH_INTERVAL_SECONDS so rankings keep decaying and failed work is retried.
+    last_cycle = 0.0
     while True:
         try:
-            print(f"--- Cycle Start: {datetime.fromtimestamp(time.time()).strftime('%H:%M:%S')} ---")
-            
-            # 1. Fetch
-            items_added = source_manager.fetch_all()
-            print(f"Fetched {items_added} new items.")
-            
-            # 2. L1 Filter
-            # Process ALL pending items
-            print("L1: Starting batch processing...")
-            while True:
-                count = l1_filter.process_pending(batch_size=config.L1_BATCH_SIZE)
-                if count == 0:
-                    break
-            
-            # 3. L2 Scorer
-            # Process ALL items that passed L1
-            print("L2: Starting batch processing...")
-            while True:
-                count = l2_scorer.process_l1_passed()
-                if count == 0:
-                    break
-            
-            # 4. Display/Ranking (Preview)
-            # Fetch all processed items from last window
-            processed = db.get_recent_processed_news(hours=config.RANKING_WINDOW_HOURS)
-            if processed:
-                header = f"\n=== Top News (Last {config.RANKING_WINDOW_HOURS}h, Gravity={config.GRAVITY}) ==="
-                print(header)
-                # Calculate display scores
-                ranked = []
-                for item in processed:
-                    g_score = calculate_gravity_score(item['l2_score'], item['published_at'], config.GRAVITY)
-                    ranked.append((item, g_score))
-                
-                # Sort by Gravity Score
-                ranked.sort(key=lambda x: x[1], reverse=True)
-                
-                # Prepare JSON Output
-                json_output = {
-                    "generated_at": time.time(),
-                    "generated_at_str": datetime.now().isoformat(),
-                    "config": {
-                        "gravity": config.GRAVITY,
-                        "window_hours": config.RANKING_WINDOW_HOURS
-                    },
-                    "items": []
-                }
-
-                # Display Loop
-                count = 0
-                for item, g_score in ranked:
-                    # JSON item
-                    json_item = dict(item)
-                    json_item['gravity_score'] = g_score
-                    json_output['items'].append(json_item)
-
-                    # Console Output (Top 10)
-                    if count < 10:
-                        print(f"[{g_score:.1f}] {item['l2_title_zh']} (Original: {item['l2_score']})")
-                        print(f"   {item['l2_summary']}")
-                        print(f"   URL: {item['url']}")
-                        print("")
-                    count += 1
-                
-                # Save JSON
-                with open(config.DASHBOARD_OUTPUT_PATH, 'w', encoding='utf-8') as f:
-                    json.dump(json_output, f, ensure_ascii=False, indent=2)
-                print(f"Dashboard saved to {config.DASHBOARD_OUTPUT_PATH}")
-
-                # Generate Simplified Top 5
-                generate_simplified_top5(ranked)
-
-            # Schedule Sleep
-            sleep_sec = calculate_sleep_seconds(config.FETCH_INTERVAL_SECONDS)
-            print(f"Sleeping for {sleep_sec:.1f} seconds (Next run at {datetime.fromtimestamp(time.time() + sleep_sec).strftime('%H:%M:%S')})...")
-            time.sleep(sleep_sec)
+            new_items = run_fetch()
+            if new_items or time.time() - last_cycle >= config.FETCH_INTERVAL_SECONDS:
+                print(f"--- Cycle Start: {datetime.fromtimestamp(time.time()).strftime('%H:%M:%S')} ---")
+                last_cycle = time.time()
+
+                # 1. Near-duplicate clustering + L1 Filter
+                run_l1()
+
+                # 2. L2 Scorer
+                run_l2()
+
+                # 3. Display/Ranking (Preview)
+                run_rank()
+
+                report_stats()
+                run_maintenance()
+
+            # Schedule Sleep: until the next feed is due or the next periodic cycle
+            next_cycle = last_cycle + config.FETCH_INTERVAL_SECONDS - time.time()
+            sleep_until(min(source_manager.scheduler.seconds_until_next(), next_cycle))
             
         except Exception as e:
             print(f"Main Loop Error: {e}")
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from config import config
+
+# Upper bounds (seconds) of the span duration histogram buckets.
+SPAN_BUCKETS = (0.005, 0.025, 0.1, 0.25, 1.0, 2.5, 10.0, 30.0, 60.0, 300.0)
+
+HELP = {
+    'span_seconds': "Time spent in each pipeline span",
+    'stage_items_total': "Items entering (in) and leaving (out) each pipeline stage",
+    'l1_passed_total': "Items scored high enough by L1 to go to L2",
+    'llm_cache_total': "Verdict cache lookups by result",
+    'feed_fetch_total': "Feed polls by result",
+    'fetch_bytes_total': "Feed bytes downloaded",
+    'fetch_duplicates_total': "Fetched items dropped because their canonical URL is already stored",
+    'fetch_skipped_total': "Fetched items dropped by the feed's high-water mark (listed in its last poll), included in duplicates",
+    'ai_calls_total': "Successful API calls",
+    'ai_tokens_total': "API tokens used",
+    'ai_retries_total': "API calls retried after a transient error",
+    'ai_errors_total': "API calls that failed for good",
+    'errors_total': "Spans that ended with an exception",
+    'retention_removed_total': "Expired rows moved out of the news table by status",
+    'queue_items': "Rows in the news table by status",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """
+    Process-wide counters, gauges and span timings.
+
+    span() times a block into the span_seconds histogram and, with
+    METRICS_JSON_LOGS, prints one JSON line per span. render() produces the
+    Prometheus text format served at /metrics; collectors registered with
+    add_collector refresh gauges (like queue depth) right before each render.
+    """
+
+    def __init__(self, prefix: str = "news", json_logs: bool = config.METRICS_JSON_LOGS):
+        self.prefix = prefix
+        self.json_logs = json_logs
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._spans: Dict[Labels, List[float]] = {} # bucket counts..., count, sum
+        self._collectors: List[Callable[[], None]] = []
+        self._samples: Optional[Dict[str, List[float]]] = None
+
+    def keep_samples(self, enabled: bool = True):
+        """Also keeps every raw span duration (for percentiles in benchmarks)."""
+        with self._lock:
+            self._samples = {} if enabled else None
+
+    def samples(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {span: list(values) for span, values in (self._samples or {}).items()}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not value:
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, span: str, seconds: float, **labels):
+        """Records a duration that was measured elsewhere (e.g. FeedResult.latency)."""
+        key = _labels(dict(labels, span=span))
+        with self._lock:
+            series = self._spans.get(key)
+            if series is None:
+                series = self._spans[key] = [0] * (len(SPAN_BUCKETS) + 2)
+            for idx, bound in enumerate(SPAN_BUCKETS):
+                if seconds <= bound:
+                    series[idx] += 1
+            series[-2] += 1
+            series[-1] += seconds
+            if self._samples is not None:
+                self._samples.setdefault(span, []).append(seconds)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Times the block. Exceptions are counted in errors_total and re-raised."""
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.monotonic() - start
+            self.observe(name, seconds, **labels)
+            if error:
+                self.inc('errors_total', span=name)
+            self.log('span', span=name, seconds=round(seconds, 4), error=error, **labels)
+
+    def log(self, event: str, **fields):
+        """Prints a JSON log line (when METRICS_JSON_LOGS is on). None fields are left out."""
+        if not self.json_logs:
+            return
+        record = {'ts': round(time.time(), 3), 'event': event}
+        record.update((name, value) for name, value in fields.items() if value is not None)
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+    def add_collector(self, collect: Callable[[], None]):
+        with self._lock:
+            self._collectors.append(collect)
+
+    def collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for collect in collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics: Collector failed: {e}")
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        self.collect()
+        lines = []
+
+        def header(name: str, kind: str):
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = header(name, 'counter')
+                lines.extend(f"{full}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(series.items()))
+            for name, series in sorted(self._gauges.items()):
+                full = header(name, 'gauge')
+                lines.extend(f"{full}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(series.items()))
+            if self._spans:
+                full = header('span_seconds', 'histogram')
+                for key, series in sorted(self._spans.items()):
+                    for bound, count in zip((*SPAN_BUCKETS, '+Inf'), (*series[:len(SPAN_BUCKETS)], series[-2])):
+                        lines.append(f"{full}_bucket{_format_labels(key + (('le', str(bound)),))} {_format_value(count)}")
+                    lines.append(f"{full}_count{_format_labels(key)} {_format_value(series[-2])}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {series[-1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
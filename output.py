@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from config import config
+
+try:
+    import brotli
+except ImportError: # Optional: only the .gz sibling is written without it
+    brotli = None
+
+# Fields index.html (and external consumers) actually read from dashboard items.
+DASHBOARD_FIELDS = (
+    'id', 'url', 'title', 'source_name', 'published_at',
+    'l2_score', 'l2_title_zh', 'l2_summary', 'l1_reason', 'category',
+)
+
+
+def project_item(item: Dict, gravity_score: float) -> Dict:
+    """Keeps only the dashboard fields of a news row and adds its gravity score."""
+    projected = {field: item.get(field) for field in DASHBOARD_FIELDS}
+    projected['gravity_score'] = round(gravity_score, 3)
+    return projected
+
+
+def build_dashboard(ranked: List[Tuple[Dict, float]], now: Optional[float] = None) -> Dict:
+    """Builds the dashboard.json document from [(item, gravity_score)], best first."""
+    now = now if now is not None else time.time()
+    return {
+        "generated_at": now,
+        "generated_at_str": datetime.fromtimestamp(now).isoformat(),
+        "config": {
+            "gravity": config.GRAVITY,
+            "window_hours": config.RANKING_WINDOW_HOURS
+        },
+        "items": [project_item(item, score) for item, score in ranked]
+    }
+
+
+def dashboard_fingerprint(dashboard: Dict) -> List:
+    """
+    The part of a dashboard document that counts as a change: the ranked items
+    with scores at the precision the page displays. generated_at is excluded.
+    """
+    return [
+        dict(item, gravity_score=round(item['gravity_score'], 1))
+        for item in dashboard['items']
+    ]
+
+
+def content_hash(data: Any) -> str:
+    """Stable hash of a JSON-serializable value."""
+    encoded = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _write_atomic(path: str, body: bytes):
+    # Write a sibling temp file and rename over the target, so readers
+    # (index.html polling, a static server) never see a half-written file.
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+class OutputWriter:
+    """
+    Writes JSON outputs atomically, compactly and only when their content changed.
+
+    Next to each file it keeps precompressed .gz (and .br with the brotli
+    package) siblings for static servers. Change detection hashes only the
+    ranked content, not timestamps like generated_at.
+    """
+
+    def __init__(self):
+        self._hashes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def write(self, path: str, data: Any, hash_of: Any = None) -> bool:
+        """
+        Writes data as JSON to path unless hash_of (default: data) is unchanged
+        since the last write. Returns True if the file was written.
+        """
+        digest = content_hash(data if hash_of is None else hash_of)
+        with self._lock:
+            if self._hashes.get(path) == digest and os.path.exists(path):
+                return False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        _write_atomic(path, body)
+        _write_atomic(f"{path}.gz", gzip.compress(body, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write_atomic(f"{path}.br", brotli.compress(body))
+
+        with self._lock:
+            self._hashes[path] = digest
+        return True
+
+output_writer = OutputWriter()
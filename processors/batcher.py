@@ -0,0 +1,81 @@
+import re
+import threading
+from typing import Callable, Dict, List
+
+# CJK ideographs, kana and hangul are roughly one token per character;
+# everything else averages about four characters per token.
+_WIDE_RE = re.compile("[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate for budget planning (no tokenizer dependency)."""
+    if not text:
+        return 0
+    wide = len(_WIDE_RE.findall(text))
+    return wide + (len(text) - wide + 3) // 4 + 1
+
+
+class TokenBudgetBatcher:
+    """
+    Sizes LLM batches by estimated tokens instead of a fixed item count.
+
+    A batch is the longest prefix of the candidates whose prompt fits the
+    input budget and whose expected output (items x observed output tokens
+    per item) fits the output budget. The output
+    estimate is an exponential moving average of what the model actually
+    returned, so it tunes itself to the prompt and model in use.
+    """
+
+    def __init__(self, stage: str, input_budget: int, output_budget: int,
+                 output_per_item: float, smoothing: float = 0.3):
+        self.stage = stage
+        self.input_budget = input_budget
+        self.output_budget = output_budget
+        self.output_per_item = output_per_item
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.items = 0
+
+    def plan(self, fixed_text: str, candidates: List[Dict], line: Callable[[int, Dict], str]) -> int:
+        """
+        Returns how many leading candidates fit in one request.
+        fixed_text is everything sent regardless of batch size (system prompt,
+        instructions); line(idx, item) renders one item as it appears in the prompt.
+        Always at least 1 when there are candidates.
+        """
+        with self._lock:
+            per_item = self.output_per_item
+        max_by_output = max(1, int(self.output_budget // max(per_item, 1.0)))
+        limit = min(max_by_output, len(candidates))
+
+        used = estimate_tokens(fixed_text)
+        count = 0
+        for idx, item in enumerate(candidates[:limit]):
+            used += estimate_tokens(line(idx, item))
+            if count and used > self.input_budget:
+                break
+            count += 1
+        return count
+
+    def observe(self, n_items: int, completion_tokens: int):
+        """Feeds back the actual output size of a request covering n_items."""
+        if n_items <= 0:
+            return
+        with self._lock:
+            self.calls += 1
+            self.items += n_items
+            if completion_tokens > 0:
+                sample = completion_tokens / n_items
+                self.output_per_item += self.smoothing * (sample - self.output_per_item)
+
+    def stats(self) -> str:
+        with self._lock:
+            per_call = self.items / self.calls if self.calls else 0.0
+            return (f"{self.stage} batching: {self.calls} calls, {self.items} items, "
+                    f"{per_call:.1f} items/call, ~{self.output_per_item:.0f} output tokens/item")
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.items = 0
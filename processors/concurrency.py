@@ -0,0 +1,59 @@
+import threading
+import time
+from typing import Optional
+import openai
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """True for errors that mean 'slow down' (429, timeouts, overloaded upstream)."""
+    return isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.InternalServerError))
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Reads Retry-After from an OpenAI API error response, if present."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    value = response.headers.get('retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on concurrent LLM requests.
+
+    Starts at max_in_flight. Every throttle error halves the limit (never
+    below 1) and opens a cool-down window during which no new request should
+    start; every success raises the limit by one, back up to max_in_flight.
+    """
+
+    def __init__(self, max_in_flight: int, base_backoff: float = 2.0, max_backoff: float = 60.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.limit = self.max_in_flight
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._backoff = 0.0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def on_success(self):
+        with self._lock:
+            self._backoff = 0.0
+            if self.limit < self.max_in_flight:
+                self.limit += 1
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.limit = max(1, self.limit // 2)
+            self._backoff = min(self.max_backoff, max(self.base_backoff, self._backoff * 2))
+            delay = max(self._backoff, retry_after or 0.0)
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            print(f"  - Throttled by API: limit -> {self.limit} in flight, pausing {delay:.1f}s")
+
+    def wait_time(self) -> float:
+        """Seconds to wait before starting another request."""
+        with self._lock:
+            return max(0.0, self._resume_at - time.monotonic())
@@ -0,0 +1,147 @@
+import hashlib
+import random
+import re
+import struct
+from typing import Dict, List, Optional, Sequence
+from config import config
+from database import db
+from processors.text import normalize_title
+
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS # 16 bands x 4 rows: candidates from ~0.5 Jaccard up
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240501) # Fixed seed: signatures are persisted and must stay comparable
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_RE = re.compile(r"https?://\S+")
+SUMMARY_LEAD_WORDS = 30
+CLUSTER_BATCH_SIZE = 5000 # Rows claimed per clustering pass
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def shingles(title: str, summary: str = "") -> set:
+    """
+    Character 3-grams of the normalized title (works for CJK without a
+    segmenter) plus word bigrams of the summary's lead, so the headline
+    dominates and boilerplate further down the summary does not.
+    """
+    text = normalize_title(title)
+    result = {text[i:i + 3] for i in range(max(1, len(text) - 2))} if text else set()
+    if summary:
+        lead = normalize_title(_URL_RE.sub(" ", _TAG_RE.sub(" ", summary))).split()[:SUMMARY_LEAD_WORDS]
+        result.update(f"{a} {b}" for a, b in zip(lead, lead[1:]))
+    return result
+
+
+def minhash(title: str, summary: str = "") -> Optional[bytes]:
+    """MinHash signature (NUM_PERM x uint32, packed) of an item, or None for empty text."""
+    hashes = [_hash64(s) for s in shingles(title, summary)]
+    if not hashes:
+        return None
+    signature = [min((a * h + b) % _PRIME for h in hashes) & 0xFFFFFFFF for a, b in _PERMS]
+    return struct.pack(f"<{NUM_PERM}I", *signature)
+
+
+def band_buckets(signature: bytes) -> List[int]:
+    """One LSH bucket id (signed 64-bit, fits SQLite INTEGER) per band."""
+    width = ROWS_PER_BAND * 4
+    return [
+        int.from_bytes(hashlib.blake2b(signature[i * width:(i + 1) * width], digest_size=8).digest(), 'little', signed=True)
+        for i in range(BANDS)
+    ]
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    sa = struct.unpack(f"<{NUM_PERM}I", a)
+    sb = struct.unpack(f"<{NUM_PERM}I", b)
+    return sum(1 for x, y in zip(sa, sb) if x == y) / NUM_PERM
+
+
+class Deduplicator:
+    """
+    Pre-LLM clustering of near-duplicate stories.
+
+    Every pending item is looked up in the persisted LSH index (news_lsh).
+    If it matches an earlier item from the last DEDUP_WINDOW_HOURS, it joins
+    that item's cluster, is marked 'duplicate' and never reaches the model;
+    the representative's L1/L2 verdict is copied onto it. Otherwise it starts
+    its own cluster. Because the index lives in the DB, matches span batches,
+    cycles and restarts. DEDUP_THRESHOLD >= 1.0 turns merging off: every item
+    is its own cluster (signatures are still indexed).
+
+    With 64 permutations the similarity estimate is off by about 0.06, so the
+    threshold is set well above the ~0.7 of distinct template headlines
+    ("SpaceX to launch 28 Starlink satellites ... Cape Canaveral" vs "24 ...
+    Vandenberg"): a merged item never reaches the dashboard. Rewrites this
+    misses still reach L2, which can fold them into one entry.
+    """
+
+    def __init__(self):
+        self.threshold = config.DEDUP_THRESHOLD
+        self.window_hours = config.DEDUP_WINDOW_HOURS
+        self.merged = 0
+
+    def cluster_pending(self, limit: int = CLUSTER_BATCH_SIZE) -> int:
+        """
+        Claims up to `limit` unclustered pending items and assigns their
+        clusters. Returns how many were clustered; fewer than `limit` means
+        the backlog is done (or another worker holds the rest).
+        """
+        rows = db.claim_unclustered(limit=limit)
+        if not rows:
+            return 0
+
+        assignments = [] # (news_id, cluster_id, buckets, minhash)
+        local: Dict[int, List[Dict]] = {} # bucket -> rows clustered in this pass
+        merged = 0
+        for row in rows:
+            signature = row['minhash'] or minhash(row['title'] or "")
+            if signature is None:
+                assignments.append((row['id'], row['id'], [], None))
+                continue
+            buckets = band_buckets(signature)
+            candidates = db.get_lsh_candidates(buckets, exclude_id=row['id'], window_hours=self.window_hours) if self.enabled else []
+            for bucket in buckets:
+                candidates.extend(local.get(bucket, []))
+
+            best = self._best_match(signature, candidates)
+            cluster_id = row['id']
+            if best is not None:
+                cluster_id = best['cluster_id'] or best['id']
+                merged += 1
+            entry = {'id': row['id'], 'cluster_id': cluster_id, 'minhash': signature}
+            for bucket in buckets:
+                local.setdefault(bucket, []).append(entry)
+            assignments.append((row['id'], cluster_id, buckets, signature))
+
+        db.save_clusters(assignments)
+        self.merged += merged
+        if merged:
+            print(f"Dedup: Merged {merged} of {len(rows)} new items into existing stories.")
+        return len(rows)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold < 1.0
+
+    def _best_match(self, signature: bytes, candidates: Sequence[Dict]) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        best, best_score = None, self.threshold
+        seen = set()
+        for candidate in candidates:
+            if candidate['id'] in seen or not candidate['minhash']:
+                continue
+            seen.add(candidate['id'])
+            score = similarity(signature, candidate['minhash'])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+deduplicator = Deduplicator()
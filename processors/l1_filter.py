@@ -1,113 +1,241 @@
-import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import List, Dict
 from config import config
 from database import db
 from ai_service import ai_service
+from processors.concurrency import AdaptiveLimiter, is_throttle_error, retry_after_seconds
+from processors.verdict_cache import VerdictCache
+from processors.batcher import TokenBudgetBatcher, estimate_tokens
+from processors.stream_json import JsonItemStream
+from processors.matching import ResultMatcher, MatchStats
+from metrics import metrics
+
+L1_CATEGORIES = ("AI_Algorithms", "Aerospace_HardTech", "Major_Industry_Moves")
+
+
+def _as_score(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
 
 class L1Filter:
     def __init__(self):
         self.prompt_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'prompts', 'l1.md')
         self.model = config.AI_MODEL_L1
+        self.cache = VerdictCache('l1', self.model, self.prompt_path)
+        self.batcher = TokenBudgetBatcher(
+            'L1', config.L1_INPUT_TOKEN_BUDGET, config.L1_OUTPUT_TOKEN_BUDGET, config.L1_OUTPUT_TOKENS_PER_ITEM
+        )
+        self.matching = MatchStats('L1')
 
     def _load_prompt(self) -> str:
         with open(self.prompt_path, 'r', encoding='utf-8') as f:
             return f.read()
 
+    def _format_line(self, idx: int, item: Dict) -> str:
+        return f"{idx + 1}. {item['title']} ({item['source_name']})\n"
+
+    def _user_prompt(self, news_list_str: str) -> str:
+        return f"Here is the list of news items to filter:\n\n{news_list_str}\n\nPlease output the JSON object as specified."
+
+    def _claim_batch(self, batch_size: int) -> List[Dict]:
+        """
+        Claims the next batch, sized by the token budget (at most batch_size items).
+        Returns [] once nothing is pending.
+        """
+        fixed_text = self._load_prompt() + self._user_prompt("")
+        db.reclaim_expired('l1')
+        for _ in range(3):
+            candidates = db.get_pending_news(limit=batch_size)
+            if not candidates:
+                return []
+            count = self.batcher.plan(fixed_text, candidates, self._format_line)
+            items = db.claim('l1', ids=[item['id'] for item in candidates[:count]])
+            if items:
+                return items
+            # Another worker claimed these rows first; look again.
+        return []
+
     def process_pending(self, batch_size: int = config.L1_BATCH_SIZE) -> int:
-        items = db.get_pending_news(limit=batch_size)
+        """Claims and processes one batch. Returns the number of items claimed."""
+        items = self._claim_batch(batch_size)
         if not items:
             return 0
+        try:
+            self._process_batch(items)
+        except Exception as e:
+            print(f"L1: Batch failed: {e}")
+        return len(items)
+
+    def process_all(self, batch_size: int = config.L1_BATCH_SIZE, max_in_flight: int = config.L1_MAX_IN_FLIGHT) -> int:
+        """
+        Drains the pending queue, keeping up to max_in_flight batches at the API.
+        Batches are claimed atomically from the DB. Throttle errors (429/timeouts)
+        shrink the in-flight limit and pause dispatch; failed batches go back to
+        'pending'. Stops early after AI_MAX_CONSECUTIVE_FAILURES failed batches.
+        Returns the number of items processed.
+        """
+        limiter = AdaptiveLimiter(max_in_flight)
+        in_flight = {}
+        processed = 0
+        failures = 0
+        drained = False
+
+        with ThreadPoolExecutor(max_workers=limiter.max_in_flight, thread_name_prefix="l1") as pool:
+            while True:
+                give_up = failures >= config.AI_MAX_CONSECUTIVE_FAILURES
+                while not drained and not give_up and len(in_flight) < limiter.limit and limiter.wait_time() == 0:
+                    items = self._claim_batch(batch_size)
+                    if not items:
+                        drained = True
+                        break
+                    in_flight[pool.submit(self._process_batch, items)] = len(items)
+
+                if not in_flight:
+                    if drained or give_up:
+                        break
+                    time.sleep(limiter.wait_time())
+                    continue
+
+                done, _ = wait(in_flight, timeout=limiter.wait_time() or None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    size = in_flight.pop(future)
+                    try:
+                        future.result()
+                        processed += size
+                        failures = 0
+                        limiter.on_success()
+                    except Exception as e:
+                        # The batch was released back to the queue; look again.
+                        failures += 1
+                        drained = False
+                        if is_throttle_error(e):
+                            limiter.on_throttle(retry_after_seconds(e))
+                        else:
+                            print(f"L1: Batch failed: {e}")
+
+        if failures >= config.AI_MAX_CONSECUTIVE_FAILURES:
+            print(f"L1: Giving up for this cycle after {failures} consecutive failures.")
+        return processed
+
+    def _process_batch(self, items: List[Dict]):
+        """
+        Sends one claimed batch to the model and stores the verdicts.
+        Raises on API errors. Unfinished items go back to 'pending' (or are
+        dead-lettered after QUEUE_MAX_ATTEMPTS); throttling does not count
+        as an attempt.
+        """
+        error = None
+        try:
+            self._run_batch(items)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            db.release(
+                'l1', [item['id'] for item in items],
+                error=str(error) if error else "not in model output",
+                count_attempt=error is None or not is_throttle_error(error)
+            )
+
+    def _save_results(self, results: List[tuple]):
+        db.update_l1_results(results)
+        metrics.inc('stage_items_total', len(results), stage='l1', direction='out')
+        metrics.inc('l1_passed_total', sum(1 for row in results if row[3] == 'l1_done'))
+
+    def _run_batch(self, items: List[Dict]):
+        metrics.inc('stage_items_total', len(items), stage='l1', direction='in')
+        # Items judged before (same title, model and prompt) skip the API.
+        cached, items = self.cache.lookup(items)
+        self._save_results([
+            (news_id, verdict['score'], verdict['reason'], verdict['status'])
+            for news_id, verdict in cached.items()
+        ])
+        if cached:
+            print(f"L1: {len(cached)} items answered from cache.")
+        if not items:
+            return
 
         print(f"L1: Processing {len(items)} items...")
-        
-        # Prepare input for AI
-        news_list_str = ""
-        id_map = {} # Map temporary ID to DB ID
-        
-        for idx, item in enumerate(items):
-            temp_id = idx + 1
-            id_map[temp_id] = item['id']
-            news_list_str += f"{temp_id}. {item['title']} ({item['source_name']})\n"
+        self._query(items, retry_unmatched=True)
+
+    def _query(self, items: List[Dict], retry_unmatched: bool):
+        """
+        One streamed request for items. Verdicts are matched back by the item
+        numbers the model echoes (see ResultMatcher). If too many outputs match
+        nothing, the items left unanswered are asked about once more on their
+        own instead of being filtered.
+        """
+        news_list_str = "".join(self._format_line(idx, item) for idx, item in enumerate(items))
 
         # Construct Prompt
         system_prompt = self._load_prompt()
-        user_prompt = f"Here is the list of news items to filter:\n\n{news_list_str}\n\nPlease output the JSON object as specified."
-
-        # Call AI
-        response_text = ai_service.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            model=self.model,
-            response_format={"type": "json_object"}
-        )
+        user_prompt = self._user_prompt(news_list_str)
 
-        if not response_text:
-            print("L1: No response from AI.")
-            return
+        # Call AI, streamed: each verdict is parsed as soon as its JSON object closes
+        parser = JsonItemStream()
+        matcher = ResultMatcher(items)
+        matched = set()
+        results = [] # (news_id, score, reason, status)
 
+        def on_text(delta: str):
+            for category, item_data in parser.feed(delta):
+                if category not in L1_CATEGORIES:
+                    continue
+                score = _as_score(item_data.get('score'))
+                status = 'l1_done' if score >= 70 else 'filtered'
+                reason = f"Category: {category}. Context: {item_data.get('context')}"
+                # A merged entry covers every item it lists.
+                for item in matcher.match(item_data):
+                    if item['id'] not in matched:
+                        matched.add(item['id'])
+                        results.append((item['id'], score, reason, status))
+                        print(f"  - Update {item['id']}: Score {score} ({status})")
+
+        result = None
+        missing = []
         try:
-            # Handle potential markdown fencing
-            clean_json = response_text.replace("```json", "").replace("```", "").strip()
-            data = json.loads(clean_json)
-            
-            # Categories in JSON based on prompt: "AI_Algorithms", "Aerospace_HardTech", "Major_Industry_Moves"
-            # We need to map these back to our items.
-            # The prompt example shows output does NOT use IDs, but titles.
-            # This is risky. Let's see if we can enforce IDs or matches by title.
-            # The prompt instructions say: "Format: Output the result as a strict, valid JSON object."
-            # It creates lists under categories.
-            # PROMPT ISSUE: The prompt examples output "title", "sources", "score".
-            # It doesn't reference the Input ID.
-            # We can fuzzy match titles or just trust the response.
-            # Better strategy: Modify prompt dynamically to ask for ID? 
-            # Or just match by title since we have the list.
-            
-            processed_titles = set()
-            
-            # Helper to update
-            def update_item(item_data, category):
-                title = item_data.get('title')
-                score = item_data.get('score', 0)
-                context = item_data.get('context')
-                
-                # Find the original item by title
-                # Simple exact match first
-                matched_id = None
-                for candidate in items:
-                    # Normalize for comparison
-                    if candidate['title'].strip() == title.strip():
-                        matched_id = candidate['id']
-                        break
-                
-                # If valid match
-                if matched_id:
-                    processed_titles.add(matched_id)
-                    # Decide status
-                    status = 'l1_done' if score >= 70 else 'filtered'
-                    reason = f"Category: {category}. Context: {context}"
-                    db.update_l1_result(matched_id, score, reason, status)
-                    print(f"  - Update {matched_id}: Score {score} ({status})")
-
-            for category in ["AI_Algorithms", "Aerospace_HardTech", "Major_Industry_Moves"]:
-                if category in data:
-                    for item_data in data[category]:
-                        update_item(item_data, category)
-            
-            # Mark others as filtered (low score, implicit) if not in list?
-            # The prompt says: "Discard any item with a Score < 70."
-            # So if it's not in the output, it's filtered.
-            for item in items:
-                if item['id'] not in processed_titles:
-                    db.update_l1_result(item['id'], 0, "Implicitly filtered by AI (Low Score)", "filtered")
-                    
-        except json.JSONDecodeError:
-            print(f"L1: Failed to parse JSON: {response_text}")
-        except Exception as e:
-            print(f"L1: Processing Error: {e}")
-            
-        return len(items)
+            with metrics.span('l1_call', model=self.model):
+                result = ai_service.complete_stream(
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    model=self.model,
+                    on_text=on_text,
+                    response_format={"type": "json_object"}
+                )
+        finally:
+            # Everything parsed so far is kept, even if the stream broke off.
+            # One transaction for the whole response.
+            complete = result is not None and result.finish_reason != 'length' and parser.closed
+            if complete:
+                missing = [item for item in items if item['id'] not in matched]
+                if not (retry_unmatched and missing and matcher.mismatch_rate > config.MATCH_REQUERY_THRESHOLD):
+                    # The prompt says: "Discard any item with a Score < 70."
+                    # So if it's not in the output, it's filtered.
+                    for item in missing:
+                        results.append((item['id'], 0, "Implicitly filtered by AI (Low Score)", "filtered"))
+                    missing = []
+            self._save_results(results)
+            self.cache.store(items, {
+                news_id: {'score': score, 'reason': reason, 'status': status}
+                for news_id, score, reason, status in results
+            })
+            self.matching.record(matcher, requeried=len(missing))
+
+        response_text = result.text
+        self.batcher.observe(len(items), result.completion_tokens or estimate_tokens(response_text))
+        if not response_text:
+            raise RuntimeError("No response from AI.")
+        if not complete:
+            # The unanswered items go back to 'pending' for another try.
+            raise RuntimeError(f"Incomplete JSON response, kept {len(matched)} of {len(items)} verdicts: {response_text[-200:]}")
+        if missing:
+            print(f"L1: {matcher.unmatched} of {matcher.entries} outputs unmatched, re-querying {len(missing)} items.")
+            self._query(missing, retry_unmatched=False)
 
 l1_filter = L1Filter()
@@ -1,108 +1,176 @@
-import json
 import os
+from typing import Dict, List, Optional
 from config import config
 from database import db
 from ai_service import ai_service
+from processors.verdict_cache import VerdictCache
+from processors.batcher import TokenBudgetBatcher, estimate_tokens
+from processors.stream_json import JsonItemStream
+from processors.matching import ResultMatcher, MatchStats
+from processors.concurrency import is_throttle_error
+from metrics import metrics
 
 class L2Scorer:
     def __init__(self):
         self.prompt_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'prompts', 'l2.md')
         self.model = config.AI_MODEL_L2
+        self.cache = VerdictCache('l2', self.model, self.prompt_path)
+        self.batcher = TokenBudgetBatcher(
+            'L2', config.L2_INPUT_TOKEN_BUDGET, config.L2_OUTPUT_TOKEN_BUDGET, config.L2_OUTPUT_TOKENS_PER_ITEM
+        )
+        self.matching = MatchStats('L2')
 
     def _load_prompt(self) -> str:
         with open(self.prompt_path, 'r', encoding='utf-8') as f:
             return f.read()
 
+    def _format_line(self, idx: int, item: Dict) -> str:
+        # Include URL so AI can return it in the JSON
+        return f"{idx+1}. \"{item['title']}\" ({item['source_name']}) - {item['url']}\n"
+
+    def _user_prompt(self, news_list_str: str) -> str:
+        return f"Input:\n\n{news_list_str}\n\nPlease generate the output JSON feed."
+
+    def _save_results(self, results: List[tuple], merged: Optional[List[tuple]] = None,
+                      filtered: Optional[List[int]] = None):
+        db.update_l2_results(results, merged=merged, filtered=filtered)
+        metrics.inc('stage_items_total', len(results) + len(merged or ()) + len(filtered or ()), stage='l2', direction='out')
+
     def process_l1_passed(self):
+        """
+        Leases and scores one batch of items that passed L1. Returns the number
+        of items handled (0 when the queue is empty or the batch failed).
+        """
         # Items that passed L1 but pending L2
-        items = db.get_high_score_pending_l2(limit=config.L2_BATCH_SIZE)
-        if not items:
+        db.reclaim_expired('l2')
+        candidates = db.get_high_score_pending_l2(limit=config.L2_BATCH_SIZE)
+        if not candidates:
             return 0
 
-        print(f"L2: Processing {len(items)} items...")
-        
-        # Prepare input
-        # L2 prompt asks for "Input list".
-        news_list_str = ""
-        for idx, item in enumerate(items):
-            # Include URL so AI can return it in the JSON
-            news_list_str += f"{idx+1}. \"{item['title']}\" ({item['source_name']}) - {item['url']}\n"
+        # Items scored before (same title, model and prompt) skip the API.
+        cached, candidates = self.cache.lookup(candidates)
+        metrics.inc('stage_items_total', len(cached), stage='l2', direction='in')
+        self._save_results([
+            (news_id, verdict['score'], verdict['summary'], verdict['title_zh'], verdict['category'])
+            for news_id, verdict in cached.items() if not verdict.get('filtered')
+        ], filtered=[news_id for news_id, verdict in cached.items() if verdict.get('filtered')])
+        if cached:
+            print(f"L2: {len(cached)} items answered from cache.")
+        if not candidates:
+            return len(cached)
 
         system_prompt = self._load_prompt()
-        user_prompt = f"Input:\n\n{news_list_str}\n\nPlease generate the output JSON feed."
-
-        response_text = ai_service.chat_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            model=self.model,
-            response_format={"type": "json_object"}
-        )
 
-        if not response_text:
-            print("L2: No response.")
-            return
+        # Send as many as fit the token budget; the rest stay 'l1_done' for the next round.
+        count = self.batcher.plan(system_prompt + self._user_prompt(""), candidates, self._format_line)
+        items = db.claim('l2', ids=[item['id'] for item in candidates[:count]])
+        if not items:
+            # Another worker leased these rows first.
+            return len(cached)
 
+        metrics.inc('stage_items_total', len(items), stage='l2', direction='in')
+        print(f"L2: Processing {len(items)} items...")
+        error = None
         try:
-            clean_json = response_text.replace("```json", "").replace("```", "").strip()
-            data = json.loads(clean_json)
-            
-            # Output format: { "feed": [ { "category":..., "title_optimized":..., "score":..., "original_sources":..., "technical_summary":..., "url":... } ] }
-            # Again, matching back is tricky because the prompt is designed to "Process raw news list" which implies it handles the list.
-            # But the prompt output example includes "url" which might be missing if I didn't provide it in user prompt?
-            # Wait, I didn't provide URL in user_prompt above: f"{idx+1}. \"{item['title']}\" ({item['source_name']})\n"
-            # So the AI cannot invent the URL.
-            # I should include URL in the input so it can return it, OR I use the title to match back.
-            # L2 prompt says: "url": "String (Link to the best source)".
-            # So I must provide the URL in the input.
-            
-            # Let's Refine the User Prompt construction
-            news_list_str = ""
-            for idx, item in enumerate(items):
-                news_list_str += f"{idx+1}. \"{item['title']}\" ({item['source_name']}) - {item['url']}\n"
-                
-            # Rerun logic with better input (conceptually, I'll just update the code below to use this)
-            
-            feed_items = data.get('feed', [])
-            
-            # Map back strategy: match by Title or URL. URL is safest.
-            
-            for feed_item in feed_items:
+            self._query(items, retry_unmatched=True)
+        except Exception as e:
+            error = e
+            print(f"AI Service Error: {e}")
+            return 0
+        finally:
+            # Items the model did not answer go back to 'l1_done', or are
+            # dead-lettered after QUEUE_MAX_ATTEMPTS, so this can't spin forever.
+            db.release(
+                'l2', [item['id'] for item in items],
+                error=str(error) if error else "not in model output",
+                count_attempt=error is None or not is_throttle_error(error)
+            )
+        return len(cached) + len(items)
+
+    def _query(self, items: List[Dict], retry_unmatched: bool):
+        """
+        One streamed request for items. Entries are matched back by the item
+        numbers the model echoes, then by URL and title (see ResultMatcher).
+        If too many entries match nothing, the unanswered items are asked
+        about once more on their own. Otherwise items left out of a complete
+        response are filtered (the prompt says to drop low-value ones).
+        """
+        system_prompt = self._load_prompt()
+        news_list_str = "".join(self._format_line(idx, item) for idx, item in enumerate(items))
+        user_prompt = self._user_prompt(news_list_str)
+
+        # Streamed: each feed entry is parsed as soon as its JSON object closes.
+        parser = JsonItemStream()
+        matcher = ResultMatcher(items)
+        done = set()
+        results = [] # (news_id, score, summary, title_zh, category)
+        merged = [] # (news_id, representative id)
+
+        def on_text(delta: str):
+            for key, feed_item in parser.feed(delta):
+                if key != 'feed':
+                    continue
                 optimized_title = feed_item.get('title_optimized')
-                score = feed_item.get('score', 0)
-                summary = feed_item.get('technical_summary')
-                category = feed_item.get('category')
-                
-                # We need to find which original item this corresponds to.
-                # The AI might have merged items (Deduplication).
-                # "Group multiple articles about the same event."
-                # If it merged, we might lose track of which specific ID it was.
-                # But typically we want to update the DB record.
-                # If it merges, we should pick one "representative" ID to update and mark others as "merged_out" or similar?
-                # For simplicity, let's assume it picks one.
-                
-                # We'll try to match by similarity or just loop and see if url matches.
-                # The AI output includes "url".
-                out_url = feed_item.get('url')
-                
-                matched_id = None
-                if out_url:
-                    for item in items:
-                        if item['url'] == out_url:
-                            matched_id = item['id']
-                            break
-                
-                # If ID found
-                if matched_id:
-                    db.update_l2_result(matched_id, score, summary, optimized_title, category)
-                    print(f"  - L2 Done {matched_id}: {optimized_title}")
-                else:
+                covered = [item for item in matcher.match(feed_item, url_key='url') if item['id'] not in done]
+                if not covered:
                     print(f"  - Warning: Could not match L2 output to DB: {optimized_title}")
+                    continue
 
-        except Exception as e:
-            print(f"L2 Error: {e}")
-            
-        return len(items)
+                # The AI might have merged items (Deduplication): the first one
+                # carries the entry, the others join its cluster as duplicates.
+                representative = covered[0]['id']
+                done.update(item['id'] for item in covered)
+                results.append((representative, feed_item.get('score', 0), feed_item.get('technical_summary'),
+                                optimized_title, feed_item.get('category')))
+                merged.extend((item['id'], representative) for item in covered[1:])
+                print(f"  - L2 Done {representative}: {optimized_title}")
+
+        result = None
+        missing = []
+        requery = False
+        try:
+            with metrics.span('l2_call', model=self.model):
+                result = ai_service.complete_stream(
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    model=self.model,
+                    on_text=on_text,
+                    response_format={"type": "json_object"}
+                )
+        finally:
+            # Entries parsed before an error or truncation are kept, in one transaction.
+            filtered = []
+            complete = result is not None and result.finish_reason != 'length' and parser.closed
+            if complete:
+                missing = [item for item in items if item['id'] not in done]
+                requery = bool(retry_unmatched and missing and matcher.mismatch_rate > config.MATCH_REQUERY_THRESHOLD)
+                if not requery:
+                    # Left out on purpose (Tier 3); unanswered items of a broken
+                    # response are released instead, and retried or dead-lettered.
+                    filtered = [item['id'] for item in missing]
+            self._save_results(results, merged=merged, filtered=filtered)
+            verdicts = {
+                news_id: {'score': score, 'summary': summary, 'title_zh': title_zh, 'category': category}
+                for news_id, score, summary, title_zh, category in results
+            }
+            verdicts.update((news_id, {'filtered': True}) for news_id in filtered)
+            self.cache.store(items, verdicts)
+            self.matching.record(matcher, requeried=len(missing) if requery else 0)
+
+        response_text = result.text
+        self.batcher.observe(len(items), result.completion_tokens or estimate_tokens(response_text))
+
+        if not response_text:
+            print("L2: No response.")
+            return
+        if not complete:
+            print(f"L2: Incomplete JSON response, kept {len(results)} of {len(items)} entries.")
+        elif filtered:
+            print(f"L2: {len(filtered)} items left out by the model, filtered.")
+        elif requery:
+            print(f"L2: {matcher.unmatched} of {matcher.entries} outputs unmatched, re-querying {len(missing)} items.")
+            self._query(missing, retry_unmatched=False)
 
 l2_scorer = L2Scorer()
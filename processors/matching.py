@@ -0,0 +1,89 @@
+import threading
+from typing import Dict, List, Optional
+from processors.text import normalize_title
+
+
+class ResultMatcher:
+    """
+    Maps model output entries back to the batch items they answer.
+
+    Items are numbered 1..n in the prompt and the model echoes those numbers
+    in "ids" (or "id"), which is a plain dict lookup. Entries without usable
+    ids fall back to exact URL, then normalized title. Entries that match
+    nothing are counted in `unmatched`.
+    """
+
+    def __init__(self, items: List[Dict]):
+        self.by_number = {idx + 1: item for idx, item in enumerate(items)}
+        self.by_url = {item['url']: item for item in items if item.get('url')}
+        self.by_title = {}
+        for item in items:
+            self.by_title.setdefault(normalize_title(item.get('title') or ""), item)
+        self.entries = 0
+        self.by_id = 0
+        self.by_fallback = 0
+        self.unmatched = 0
+
+    def _numbers(self, entry: Dict) -> List[int]:
+        value = entry.get('ids', entry.get('id'))
+        values = value if isinstance(value, list) else [value]
+        numbers = []
+        for v in values:
+            try:
+                numbers.append(int(v))
+            except (TypeError, ValueError):
+                continue
+        return numbers
+
+    def match(self, entry: Dict, title_key: str = 'title', url_key: Optional[str] = None) -> List[Dict]:
+        """Returns the items an output entry covers (empty if it matches none)."""
+        self.entries += 1
+        items = [self.by_number[n] for n in self._numbers(entry) if n in self.by_number]
+        if items:
+            self.by_id += 1
+            return items
+
+        item = None
+        if url_key and entry.get(url_key):
+            item = self.by_url.get(entry[url_key])
+        if item is None and entry.get(title_key):
+            item = self.by_title.get(normalize_title(str(entry[title_key])))
+        if item is not None:
+            self.by_fallback += 1
+            return [item]
+        self.unmatched += 1
+        return []
+
+    @property
+    def mismatch_rate(self) -> float:
+        return self.unmatched / self.entries if self.entries else 0.0
+
+
+class MatchStats:
+    """Per-stage totals of how model outputs were matched to items."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def record(self, matcher: ResultMatcher, requeried: int = 0):
+        with self._lock:
+            self.entries += matcher.entries
+            self.by_id += matcher.by_id
+            self.by_fallback += matcher.by_fallback
+            self.unmatched += matcher.unmatched
+            self.requeried += requeried
+
+    def stats(self) -> str:
+        with self._lock:
+            return (f"{self.stage} matching: {self.entries} outputs, {self.by_id} by id, "
+                    f"{self.by_fallback} by url/title, {self.unmatched} unmatched, {self.requeried} items re-queried")
+
+    def reset_stats(self):
+        with self._lock:
+            self.entries = 0
+            self.by_id = 0
+            self.by_fallback = 0
+            self.unmatched = 0
+            self.requeried = 0
@@ -0,0 +1,71 @@
+import time
+from typing import Dict, Optional
+from config import config
+from database import db
+from metrics import metrics
+
+# Batches per status per run, so one run never holds the write lock for long.
+ARCHIVE_BATCH = 5000
+
+
+class Retention:
+    """
+    Keeps the hot news table bounded to roughly the ranking window plus the
+    L1/L2 backlog.
+
+    Rows in a final status expire after that status's TTL (0 keeps them).
+    They move to the compressed news_archive table (unless RETENTION_ARCHIVE
+    is off), and their url_key hash stays in url_hashes so feeds that still
+    list them do not bring them back. Queue states (pending, running,
+    l1_done) never expire. Each run also drops MinHash/LSH data older than the
+    dedup window, then runs incremental vacuum and ANALYZE.
+    """
+
+    def __init__(self):
+        self.ttl_hours: Dict[str, float] = {
+            # Never drop what dedup still matches against (url_hashes covers exact URLs after that).
+            'filtered': config.RETENTION_FILTERED_HOURS and max(config.RETENTION_FILTERED_HOURS, config.DEDUP_WINDOW_HOURS),
+            'duplicate': config.RETENTION_DUPLICATE_HOURS and max(config.RETENTION_DUPLICATE_HOURS, config.DEDUP_WINDOW_HOURS),
+            # Never drop what the dashboard still ranks.
+            'processed': config.RETENTION_PROCESSED_HOURS and max(config.RETENTION_PROCESSED_HOURS, config.RANKING_WINDOW_HOURS),
+            'l1_dead': config.RETENTION_DEAD_HOURS,
+            'l2_dead': config.RETENTION_DEAD_HOURS,
+        }
+        self.archive = config.RETENTION_ARCHIVE
+        self.interval = config.RETENTION_INTERVAL_HOURS * 3600
+        self.last_run: Optional[float] = None
+
+    def run_if_due(self) -> Optional[Dict[str, int]]:
+        """Runs once per RETENTION_INTERVAL_HOURS (first call runs right away)."""
+        if not self.interval or (self.last_run and time.time() - self.last_run < self.interval):
+            return None
+        return self.run()
+
+    def run(self) -> Dict[str, int]:
+        self.last_run = time.time()
+        removed = {}
+        with metrics.span('retention'):
+            for status, hours in self.ttl_hours.items():
+                if not hours:
+                    continue
+                cutoff = self.last_run - hours * 3600
+                total = 0
+                while True:
+                    count = db.archive_expired(status, cutoff, archive=self.archive, limit=ARCHIVE_BATCH)
+                    total += count
+                    if count < ARCHIVE_BATCH:
+                        break
+                if total:
+                    removed[status] = total
+                    metrics.inc('retention_removed_total', total, status=status)
+            compacted = db.compact_dedup_index(self.last_run - config.DEDUP_WINDOW_HOURS * 3600)
+            maintenance = db.maintain()
+
+        verb = "Archived" if self.archive else "Deleted"
+        summary = ", ".join(f"{count} {status}" for status, count in removed.items()) or "nothing"
+        print(f"Retention: {verb} {summary}; compacted {compacted} dedup signatures; "
+              f"freed {maintenance['freed_pages']} pages ({maintenance['pages']} in use)"
+              + ("; converted database to incremental vacuum" if maintenance['converted'] else ""))
+        return dict(removed, compacted=compacted, **maintenance)
+
+retention = Retention()
@@ -0,0 +1,67 @@
+import json
+from typing import Iterator, List, Optional, Tuple
+
+
+class JsonItemStream:
+    """
+    Incremental parser for LLM responses shaped like {"key": [{...}, {...}], ...}.
+
+    Text is fed in arbitrary chunks (stream deltas); every object inside a
+    top-level array is yielded as (key, object) as soon as its closing brace
+    arrives. Anything before the first '{' (markdown fences, chatter) is
+    ignored, and an object cut off by a truncated response is never yielded.
+    """
+
+    def __init__(self):
+        self._stack: List[str] = [] # open '{' / '['
+        self._in_string = False
+        self._escape = False
+        self._string: List[str] = []
+        self._last_string: Optional[str] = None
+        self._key: Optional[str] = None
+        self._item: Optional[List[str]] = None # text of the item being read
+        self.errors = 0
+        self.closed = False # the top-level value has been read to its end
+
+    def feed(self, chunk: str) -> Iterator[Tuple[Optional[str], dict]]:
+        for char in chunk:
+            if self._item is not None:
+                self._item.append(char)
+            stack = self._stack
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(stack) == 1:
+                        self._last_string = "".join(self._string)
+                elif len(stack) == 1:
+                    self._string.append(char)
+                continue
+
+            if char == '"':
+                if stack:
+                    self._in_string = True
+                    self._string = []
+            elif char == ':' and len(stack) == 1:
+                self._key = self._last_string
+            elif char in '{[':
+                if char == '{' and len(stack) == 2 and stack[-1] == '[':
+                    self._item = ['{']
+                stack.append(char)
+            elif char in '}]' and stack:
+                stack.pop()
+                if not stack:
+                    self.closed = True
+                if char == '}' and self._item is not None and len(stack) == 2:
+                    item_text, self._item = "".join(self._item), None
+                    try:
+                        value = json.loads(item_text)
+                    except json.JSONDecodeError:
+                        self.errors += 1
+                        continue
+                    if isinstance(value, dict):
+                        yield self._key, value
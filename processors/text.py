@@ -0,0 +1,17 @@
+import re
+import unicodedata
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_title(text: str) -> str:
+    """
+    Canonical form of a headline for matching and cache keys: NFKC, casefolded,
+    punctuation dropped, whitespace collapsed. Works for CJK titles too.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
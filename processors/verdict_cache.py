@@ -0,0 +1,84 @@
+import hashlib
+import json
+import threading
+from typing import Dict, List, Tuple
+from config import config
+from database import db
+from metrics import metrics
+from processors.text import normalize_title
+
+
+class VerdictCache:
+    """
+    Content-addressed cache of per-item LLM verdicts for one stage.
+
+    Keys are sha256(model, prompt file hash, normalized title), so the same
+    story syndicated under different URLs, or re-queued after a crash, skips
+    the API. Editing the prompt or switching model invalidates the entries.
+    Rows live in the llm_cache table; evict() applies TTL and size bounds.
+    """
+
+    def __init__(self, stage: str, model: str, prompt_path: str):
+        self.stage = stage
+        self.model = model
+        self.prompt_path = prompt_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _prompt_hash(self) -> str:
+        with open(self.prompt_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _key(self, prompt_hash: str, item: Dict) -> str:
+        material = "\x1f".join([self.stage, self.model, prompt_hash, normalize_title(item['title'])])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def keys(self, items: List[Dict]) -> Dict[int, str]:
+        """Maps news id -> cache key."""
+        prompt_hash = self._prompt_hash()
+        return {item['id']: self._key(prompt_hash, item) for item in items}
+
+    def lookup(self, items: List[Dict]) -> Tuple[Dict[int, Dict], List[Dict]]:
+        """Splits items into ({news id: cached verdict}, items that need the API)."""
+        keys = self.keys(items)
+        cached = db.get_cached_verdicts(list(keys.values()))
+        hits = {}
+        misses = []
+        for item in items:
+            verdict = cached.get(keys[item['id']])
+            if verdict is None:
+                misses.append(item)
+            else:
+                hits[item['id']] = verdict
+        with self._lock:
+            self.hits += len(hits)
+            self.misses += len(misses)
+        metrics.inc('llm_cache_total', len(hits), stage=self.stage, result='hit')
+        metrics.inc('llm_cache_total', len(misses), stage=self.stage, result='miss')
+        return hits, misses
+
+    def store(self, items: List[Dict], verdicts: Dict[int, Dict]):
+        """Caches the verdicts (keyed by news id) produced for these items."""
+        keys = self.keys(items)
+        rows = [
+            (keys[item['id']], self.stage, json.dumps(verdicts[item['id']], ensure_ascii=False))
+            for item in items if item['id'] in verdicts
+        ]
+        db.put_cached_verdicts(rows)
+
+    def stats(self) -> str:
+        with self._lock:
+            total = self.hits + self.misses
+            rate = self.hits / total * 100 if total else 0.0
+            return f"{self.stage} cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    @staticmethod
+    def evict() -> int:
+        """Drops entries older than LLM_CACHE_TTL_HOURS and the oldest beyond LLM_CACHE_MAX_ENTRIES."""
+        return db.evict_cached_verdicts(config.LLM_CACHE_TTL_HOURS * 3600, config.LLM_CACHE_MAX_ENTRIES)
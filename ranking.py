@@ -1,6 +1,19 @@
+import heapq
 import time
+from array import array
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
 
-def calculate_gravity_score(base_score: float, published_at_ts: float, gravity: float = 1.8) -> float:
+try:
+    import numpy as np
+except ImportError: # A dependency (pyproject.toml), but rank_items still works without it
+    np = None
+
+# Must match calculate_gravity_score below.
+OFFSET_HOURS = 6.0
+MIN_GRAVITY_FACTOR = 0.15
+MAX_GRAVITY_FACTOR = 1.2
+
+def calculate_gravity_score(base_score: float, published_at_ts: float, gravity: float = 1.8, now: Optional[float] = None) -> float:
     """
     Calculate the gravity score with score-adaptive decay.
     
@@ -13,13 +26,17 @@ def calculate_gravity_score(base_score: float, published_at_ts: float, gravity:
        - Low scores decay with full gravity.
        - High scores (near 100) decay with significantly reduced gravity (up to 50% less).
     3. Normalization: Ensures t=0 score is close to base_score.
+
+    This is the scalar reference implementation; gravity_scores must agree with it.
+    Pass `now` to score many items against the same instant.
     """
-    now = time.time()
+    if now is None:
+        now = time.time()
     age_hours = max(0, (now - published_at_ts) / 3600)
     
     # 1. Base Offset: Larger offset means time matters LESS in the beginning.
     # HN uses 2. We use 6 to suppress the "newness spike".
-    offset = 6.0
+    offset = OFFSET_HOURS
     
     # 2. Dynamic Gravity
     # Reduce gravity for high scores to give them "longevity".
@@ -37,7 +54,7 @@ def calculate_gravity_score(base_score: float, published_at_ts: float, gravity:
     
     # Clamp factor to safety range [0.15, 1.2]
     # We allow it to go very low (0.15) for practically zero decay on perfect scores during the window.
-    gravity_factor = max(0.15, min(1.2, gravity_factor))
+    gravity_factor = max(MIN_GRAVITY_FACTOR, min(MAX_GRAVITY_FACTOR, gravity_factor))
     
     effective_gravity = gravity * gravity_factor
 
@@ -48,3 +65,78 @@ def calculate_gravity_score(base_score: float, published_at_ts: float, gravity:
     time_decay = pow(offset / (age_hours + offset), effective_gravity)
     
     return base_score * time_decay
+
+
+def gravity_scores(base_scores: Sequence[float], published_at: Sequence[float], gravity: float = 1.8, now: Optional[float] = None):
+    """
+    Vectorized calculate_gravity_score over whole columns with a single `now`.
+    Returns a NumPy array when NumPy is installed, otherwise a list.
+    """
+    if now is None:
+        now = time.time()
+    if np is None:
+        return [calculate_gravity_score(s, p, gravity, now) for s, p in zip(base_scores, published_at)]
+
+    scores = np.asarray(base_scores, dtype=np.float64)
+    age_hours = np.maximum(0.0, (now - np.asarray(published_at, dtype=np.float64)) / 3600)
+    gravity_factor = np.clip(1.0 - (scores / 100.0) * 0.8, MIN_GRAVITY_FACTOR, MAX_GRAVITY_FACTOR)
+    time_decay = np.power(OFFSET_HOURS / (age_hours + OFFSET_HOURS), gravity * gravity_factor)
+    return scores * time_decay
+
+
+def _order(scores, n: int, top_k: Optional[int]) -> List[int]:
+    # Indexes of the best scores, highest first; ties keep input order.
+    if np is None:
+        if top_k is not None and top_k < n:
+            return heapq.nsmallest(top_k, range(n), key=lambda i: (-scores[i], i))
+        return sorted(range(n), key=lambda i: -scores[i])
+    if top_k is not None and top_k < n:
+        # Keep every item scoring at least the k-th best so ties resolve by input order.
+        kth = np.partition(scores, n - top_k)[n - top_k]
+        candidates = np.flatnonzero(scores >= kth)
+        return candidates[np.argsort(-scores[candidates], kind='stable')][:top_k].tolist()
+    return np.argsort(-scores, kind='stable').tolist()
+
+
+def rank_items(items: List[Any], gravity: float = 1.8, now: Optional[float] = None, top_k: Optional[int] = None,
+               score_key: str = 'l2_score', time_key: str = 'published_at') -> List[Tuple[Any, float]]:
+    """
+    Scores items in one pass and returns [(item, gravity_score)], highest first.
+    Ties keep input order, as with a stable sort. With top_k only the best
+    top_k are selected (argpartition / heap) instead of sorting everything.
+    """
+    if not items:
+        return []
+    if now is None:
+        now = time.time()
+    if np is None:
+        base = [item[score_key] or 0 for item in items]
+        published = [item[time_key] or now for item in items]
+    else:
+        base = np.fromiter((item[score_key] or 0 for item in items), dtype=np.float64, count=len(items))
+        published = np.fromiter((item[time_key] or now for item in items), dtype=np.float64, count=len(items))
+    scores = gravity_scores(base, published, gravity, now)
+    return [(items[i], float(scores[i])) for i in _order(scores, len(items), top_k)]
+
+
+def rank_rows(rows: Iterable[Tuple[int, Optional[float], Optional[float]]], gravity: float = 1.8,
+              now: Optional[float] = None, top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+    """
+    rank_items for (id, base score, published_at) rows streamed from a cursor
+    (see Database.iter_ranking_rows). Only three packed columns are kept,
+    24 bytes per row, never the rows themselves.
+    Returns [(id, gravity_score)], highest first.
+    """
+    if now is None:
+        now = time.time()
+    ids, base, published = array('q'), array('d'), array('d')
+    for news_id, score, published_at in rows:
+        ids.append(news_id)
+        base.append(score or 0)
+        published.append(published_at or now)
+    if not ids:
+        return []
+    if np is not None:
+        base, published = np.frombuffer(base, dtype=np.float64), np.frombuffer(published, dtype=np.float64)
+    scores = gravity_scores(base, published, gravity, now)
+    return [(ids[i], float(scores[i])) for i in _order(scores, len(ids), top_k)]
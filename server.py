@@ -0,0 +1,278 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from email.utils import formatdate
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from config import config
+from metrics import metrics
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html')
+MAX_PER_PAGE = 200
+REMOVED_HISTORY = 5000 # (version, id) removals kept for since= queries
+
+
+class DashboardSnapshot:
+    """
+    In-memory ranked dashboard served by DashboardServer.
+
+    Every update() that changes the ranking bumps `version`. Each item
+    remembers the version in which it last changed, so clients can ask for
+    only what changed since the version they already have. Clients see the
+    version as a token "<epoch>-<version>" (see token); the epoch is fixed
+    per process, so a token from before a restart always gets a full resync.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.epoch = format(time.time_ns() // 1000, 'x') # Process start, in hex microseconds
+        self.version = 0
+        self.document: Optional[Dict] = None
+        self.items: List[Dict] = []
+        self._item_versions: Dict[int, int] = {}
+        self._item_fingerprints: Dict[int, str] = {}
+        self._removed = deque(maxlen=REMOVED_HISTORY)
+        self._body_cache: Dict[str, Tuple[bytes, str]] = {}
+
+    def token(self, version: int) -> str:
+        return f"{self.epoch}-{version}"
+
+    def _parse_token(self, token: str) -> Optional[int]:
+        """The version in a token from this process, or None (other process, or malformed)."""
+        epoch, _, version = token.rpartition('-')
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    @staticmethod
+    def _fingerprint(item: Dict) -> str:
+        stable = dict(item, gravity_score=round(item.get('gravity_score') or 0, 1))
+        return hashlib.sha256(json.dumps(stable, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def update(self, document: Dict):
+        """Replaces the snapshot with a dashboard document (see output.build_dashboard)."""
+        items = document.get('items', [])
+        with self._lock:
+            next_version = self.version + 1
+            fingerprints = {}
+            changed = False
+            for item in items:
+                fingerprint = self._fingerprint(item)
+                fingerprints[item['id']] = fingerprint
+                if self._item_fingerprints.get(item['id']) != fingerprint:
+                    self._item_versions[item['id']] = next_version
+                    changed = True
+            for news_id in set(self._item_fingerprints) - set(fingerprints):
+                self._removed.append((next_version, news_id))
+                self._item_versions.pop(news_id, None)
+                changed = True
+            if [i['id'] for i in items] != [i['id'] for i in self.items]:
+                changed = True
+
+            self.document = document
+            self.items = items
+            self._item_fingerprints = fingerprints
+            if changed or self.version == 0:
+                self.version = next_version
+                self._body_cache = {}
+
+    def load_file(self, path: str):
+        """Seeds the snapshot from an existing dashboard.json."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Server: Failed to load {path}: {e}")
+
+    def cached_body(self, key: str, build) -> Tuple[bytes, str]:
+        """Returns (body, etag) for a response, built once per snapshot version."""
+        with self._lock:
+            cached = self._body_cache.get(key)
+            version = self.version
+        if cached:
+            return cached
+        body = json.dumps(build(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        etag = f'"{self.token(version)}-{hashlib.sha256(body).hexdigest()[:16]}"'
+        with self._lock:
+            if self.version == version and len(self._body_cache) < 256:
+                self._body_cache[key] = (body, etag)
+        return body, etag
+
+    def full(self) -> Dict:
+        with self._lock:
+            document = dict(self.document or {"items": []})
+        document['version'] = self.token(self.version)
+        return document
+
+    def page(self, page: int, per_page: int, category: Optional[str]) -> Dict:
+        with self._lock:
+            items = self.items
+            version = self.version
+            generated_at = (self.document or {}).get('generated_at')
+        if category:
+            items = [item for item in items if item.get('category') == category]
+        start = (page - 1) * per_page
+        return {
+            "version": self.token(version),
+            "generated_at": generated_at,
+            "total": len(items),
+            "page": page,
+            "per_page": per_page,
+            "items": items[start:start + per_page],
+        }
+
+    def since(self, since_token: str, category: Optional[str]) -> Dict:
+        """Items changed after the version in since_token, ids removed since then, and the new order."""
+        since_version = self._parse_token(since_token)
+        with self._lock:
+            version = self.version
+            items = self.items
+            item_versions = dict(self._item_versions)
+            removed = list(self._removed)
+            generated_at = (self.document or {}).get('generated_at')
+        oldest_known = removed[0][0] if len(removed) == self._removed.maxlen else 0
+        if since_version is None or since_version < oldest_known or since_version > version:
+            # A token from another process, or history no longer reaches back that far; client must resync.
+            result = self.page(1, len(items) or 1, category)
+            result["full"] = True
+            return result
+        if category:
+            items = [item for item in items if item.get('category') == category]
+        return {
+            "version": self.token(version),
+            "generated_at": generated_at,
+            "full": False,
+            "changed": [item for item in items if item_versions.get(item['id'], 0) > since_version],
+            "removed": [news_id for v, news_id in removed if v > since_version],
+            "order": [item['id'] for item in items],
+        }
+
+
+class DashboardServer:
+    """
+    Minimal asyncio HTTP/1.1 server for the dashboard (GET/HEAD only).
+
+    Routes:
+      /, /index.html     the dashboard page
+      /dashboard.json    full ranked snapshot (same shape as the file)
+      /api/items         ?page=&per_page=&category= paginated view
+      /api/items?since=V changes after version token V (&category=)
+      /metrics           Prometheus metrics (see metrics.py)
+    Dashboard responses have an ETag; If-None-Match gets a 304. Bodies are
+    gzipped when the client accepts it. Without a snapshot (worker roles)
+    only /metrics is served.
+    """
+
+    def __init__(self, snapshot: Optional[DashboardSnapshot], host: str = config.SERVE_HOST, port: int = config.SERVE_PORT):
+        self.snapshot = snapshot
+        self.host = host
+        self.port = port
+        self._index: Optional[Tuple[bytes, str]] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _index_body(self) -> Tuple[bytes, str]:
+        if self._index is None:
+            with open(INDEX_PATH, 'rb') as f:
+                body = f.read()
+            self._index = (body, f'"{hashlib.sha256(body).hexdigest()[:16]}"')
+        return self._index
+
+    def route(self, path: str, query: Dict[str, List[str]]) -> Tuple[int, str, bytes, Optional[str]]:
+        """Returns (status, content type, body, etag) for a GET."""
+        def arg(name: str, default: Optional[str] = None) -> Optional[str]:
+            return query.get(name, [default])[0]
+
+        if path == '/metrics':
+            return 200, 'text/plain; version=0.0.4; charset=utf-8', metrics.render().encode('utf-8'), None
+        if self.snapshot is None:
+            return 404, 'application/json', b'{"error":"not found"}', None
+        if path in ('/', '/index.html'):
+            body, etag = self._index_body()
+            return 200, 'text/html; charset=utf-8', body, etag
+        if path == '/dashboard.json':
+            body, etag = self.snapshot.cached_body('full', self.snapshot.full)
+            return 200, 'application/json', body, etag
+        if path == '/api/items':
+            try:
+                category = arg('category')
+                if arg('since') is not None:
+                    since = arg('since')
+                    key = f"since:{since}:{category}"
+                    body, etag = self.snapshot.cached_body(key, lambda: self.snapshot.since(since, category))
+                else:
+                    page = max(1, int(arg('page', '1')))
+                    per_page = min(MAX_PER_PAGE, max(1, int(arg('per_page', '20'))))
+                    key = f"page:{page}:{per_page}:{category}"
+                    body, etag = self.snapshot.cached_body(key, lambda: self.snapshot.page(page, per_page, category))
+            except ValueError:
+                return 400, 'application/json', b'{"error":"invalid query parameter"}', None
+            return 200, 'application/json', body, etag
+        return 404, 'application/json', b'{"error":"not found"}', None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = lines[0].split(' ', 2)
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            if method not in ('GET', 'HEAD'):
+                status, ctype, body, etag = 405, 'application/json', b'{"error":"method not allowed"}', None
+            else:
+                url = urlsplit(target)
+                status, ctype, body, etag = self.route(url.path, parse_qs(url.query))
+
+            extra = []
+            if etag:
+                extra.append(f"ETag: {etag}")
+                extra.append("Cache-Control: no-cache")
+                if etag in [t.strip() for t in headers.get('if-none-match', '').split(',')]:
+                    status, body = 304, b''
+            if body and 'gzip' in headers.get('accept-encoding', '') and len(body) > 1024:
+                body = gzip.compress(body, compresslevel=5)
+                extra.append("Content-Encoding: gzip")
+                extra.append("Vary: Accept-Encoding")
+
+            reason = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}[status]
+            response_head = [
+                f"HTTP/1.1 {status} {reason}",
+                f"Date: {formatdate(usegmt=True)}",
+                f"Content-Type: {ctype}",
+                f"Content-Length: {len(body)}",
+                "Connection: close",
+                *extra,
+            ]
+            writer.write(("\r\n".join(response_head) + "\r\n\r\n").encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        page = "/" if self.snapshot is not None else "/metrics"
+        print(f"Server: Listening at http://{self.host}:{self.port}{page}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self) -> threading.Thread:
+        """Runs the server on its own event loop in a daemon thread."""
+        thread = threading.Thread(target=lambda: asyncio.run(self.serve()), name="dashboard-server", daemon=True)
+        thread.start()
+        return thread
+
+dashboard_snapshot = DashboardSnapshot()
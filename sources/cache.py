@@ -0,0 +1,62 @@
+import json
+import os
+import threading
+from typing import Dict, Optional
+from config import config
+
+
+class FeedCache:
+    """
+    Persistent per-feed HTTP validators (ETag, Last-Modified, body hash).
+    Stored as a small JSON file next to the database so unchanged feeds can be
+    answered with a 304 or skipped before parsing.
+    """
+
+    def __init__(self, path: str = config.FEED_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except Exception as e:
+            print(f"Warning: Failed to load feed cache {self.path}: {e}")
+            self._entries = {}
+
+    def get(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(url)
+            return dict(entry) if entry else None
+
+    def update(self, url: str, etag: Optional[str], last_modified: Optional[str], content_hash: str):
+        with self._lock:
+            self._entries[url] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'content_hash': content_hash,
+            }
+            self._dirty = True
+
+    def save(self):
+        """Writes the cache if anything changed (temp file + rename)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._entries, ensure_ascii=False)
+            self._dirty = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Warning: Failed to save feed cache {self.path}: {e}")
@@ -1,32 +1,194 @@
-from typing import List, Dict
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional
+from urllib.parse import urlparse
 from config import config
-from sources.rss import RSSFetcher
+from sources.rss import RSSFetcher, FeedResult
+from sources.cache import FeedCache
+from sources.scheduler import FeedScheduler
+from sources.urls import SeenUrls
 from database import db
+from metrics import metrics
+from processors.dedup import minhash
+
+
+@dataclass
+class FeedStats:
+    url: str
+    latency: float = 0.0
+    items: int = 0
+    new_items: int = 0
+    bytes_read: int = 0
+    duplicates: int = 0 # Items dropped as already stored (canonical URL seen before)
+    skipped: int = 0 # Of those, listed in the feed's last poll (high-water mark); never looked up at all
+    not_modified: bool = False
+    truncated: bool = False # Body was over FEED_MAX_BYTES
+    stopped_early: bool = False # Parsing stopped at already stored entries
+    error: Optional[str] = None
+    next_poll_in: float = 0.0
+
+
+@dataclass
+class FetchSummary:
+    """Per-cycle fetch report returned by SourceManager.fetch_all."""
+    feeds: List[FeedStats] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def new_items(self) -> int:
+        return sum(f.new_items for f in self.feeds)
+
+    @property
+    def not_modified(self) -> int:
+        return sum(1 for f in self.feeds if f.not_modified)
+
+    @property
+    def duplicates(self) -> int:
+        return sum(f.duplicates for f in self.feeds)
+
+    @property
+    def bytes_read(self) -> int:
+        return sum(f.bytes_read for f in self.feeds)
+
+    @property
+    def errors(self) -> List[FeedStats]:
+        return [f for f in self.feeds if f.error]
+
+    @property
+    def slowest(self) -> Optional[FeedStats]:
+        return max(self.feeds, key=lambda f: f.latency, default=None)
+
+    def __str__(self) -> str:
+        text = (f"{len(self.feeds)} feeds in {self.elapsed:.1f}s, "
+                f"{self.not_modified} unchanged, {sum(f.items for f in self.feeds)} items, "
+                f"{self.new_items} new, {self.duplicates} duplicates, {self.bytes_read // 1024} KiB, {len(self.errors)} errors")
+        slowest = self.slowest
+        if slowest:
+            text += f" (slowest: {slowest.url} {slowest.latency:.1f}s)"
+        return text
+
 
 class SourceManager:
     def __init__(self):
-        self.rss_fetcher = RSSFetcher()
+        self.feed_cache = FeedCache()
+        self.rss_fetcher = RSSFetcher(cache=self.feed_cache)
         self.feeds = config.RSS_FEEDS
+        self.max_workers = config.FETCH_CONCURRENCY
+        self.per_host_limit = config.FETCH_PER_HOST_LIMIT
+        self.timeout = config.FETCH_TIMEOUT_SECONDS
+        self.scheduler = FeedScheduler(self.feeds)
+        # Canonical URLs already stored; known items are dropped before the DB.
+        self.seen_urls = SeenUrls(config.SEEN_URLS_MAX_ENTRIES)
+        self.seen_urls.update(db.recent_url_keys(config.SEEN_URLS_MAX_ENTRIES))
+
+    def _fetch_one(self, url: str) -> FeedResult:
+        since = self.scheduler.parse_since(url)
+        # A full parse after partial ones reads the body even if it has not changed.
+        revalidate = since is not None or not self.scheduler.partially_read(url)
+        return self.rss_fetcher.fetch_feed(url, timeout=self.timeout, since=since, revalidate=revalidate)
+
+    def _ingest(self, result: FeedResult) -> FeedStats:
+        metrics.observe('fetch_feed', result.latency, feed=result.url)
+        metrics.log('span', span='fetch_feed', seconds=round(result.latency, 4), feed=result.url, error=result.error)
+        metrics.inc('feed_fetch_total', result='error' if result.error else 'not_modified' if result.not_modified else 'ok')
+        metrics.inc('fetch_bytes_total', result.bytes_read)
+        stats = FeedStats(
+            url=result.url,
+            latency=result.latency,
+            items=len(result.items),
+            bytes_read=result.bytes_read,
+            not_modified=result.not_modified,
+            truncated=result.truncated,
+            stopped_early=result.stopped_early,
+            error=result.error,
+        )
+        with metrics.span('ingest'):
+            candidates = self.scheduler.unseen(result.url, result.items)
+            stats.skipped = stats.items - len(candidates)
+            fresh = {}
+            for item in candidates:
+                key = item.get('url_key') or item['url']
+                if key in self.seen_urls or key in fresh:
+                    continue
+                # Summaries are not stored, so the near-duplicate signature is taken now.
+                item['minhash'] = minhash(item['title'], item.get('summary', ''))
+                fresh[key] = item
+            stats.new_items = db.add_news_bulk(fresh.values())
+            # Inserted or already stored (older than the warm set), they are known now.
+            self.seen_urls.update(fresh)
+            self.rss_fetcher.commit(result)
+            stats.duplicates = stats.items - stats.new_items
+        metrics.inc('stage_items_total', stats.items, stage='fetch', direction='in')
+        metrics.inc('stage_items_total', stats.new_items, stage='fetch', direction='out')
+        metrics.inc('fetch_duplicates_total', stats.duplicates, feed=result.url)
+        metrics.inc('fetch_skipped_total', stats.skipped, feed=result.url)
+        state = self.scheduler.observe(result, stats.new_items, stats.skipped)
+        stats.next_poll_in = state['next_poll_at'] - time.time()
+        return stats
 
-    def fetch_all(self) -> int:
+    def fetch_due(self) -> FetchSummary:
+        """Fetches only the feeds whose adaptive poll interval has elapsed."""
+        return self.fetch_all(self.scheduler.due())
+
+    def fetch_all(self, urls: Optional[List[str]] = None) -> FetchSummary:
         """
-        Fetches all feeds and saves new items to DB.
-        Returns number of new items added.
+        Fetches the given feeds (default: all) concurrently and saves new items to DB.
+        Downloads run on a bounded thread pool (FETCH_CONCURRENCY overall);
+        each host has its own queue, and its next feed is only submitted when
+        one of its FETCH_PER_HOST_LIMIT fetches finishes, so no pool thread
+        waits on a busy host. DB writes stay on the calling thread.
+        Each result also reschedules its feed (see FeedScheduler). A feed whose
+        items fail to save is reported as an error and fetched in full again.
+        Returns a FetchSummary with per-feed stats.
         """
-        new_count = 0
-        for url in self.feeds:
-            print(f"Fetching {url}...")
-            items = self.rss_fetcher.fetch(url)
-            for item in items:
-                # Add to DB
-                added = db.add_news(
-                    url=item['url'],
-                    title=item['title'],
-                    source_name=item['source_name'],
-                    published_at=item['published_at']
-                )
-                if added:
-                    new_count += 1
-        return new_count
+        summary = FetchSummary()
+        urls = self.feeds if urls is None else urls
+        if not urls:
+            return summary
+        start = time.monotonic()
+        queues = defaultdict(deque) # host -> feeds not yet submitted
+        for url in urls:
+            queues[urlparse(url).netloc.lower()].append(url)
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers), thread_name_prefix="fetch") as pool:
+            futures = {} # future -> host
+
+            def submit_next(host: str):
+                if queues[host]:
+                    futures[pool.submit(self._fetch_one, queues[host].popleft())] = host
+
+            for host in list(queues):
+                for _ in range(max(1, self.per_host_limit)):
+                    submit_next(host)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    submit_next(futures.pop(future))
+                    self._report(future.result(), summary)
+        summary.elapsed = time.monotonic() - start
+        self.feed_cache.save()
+        self.scheduler.save()
+        return summary
+
+    def _report(self, result: FeedResult, summary: FetchSummary):
+        """Ingests one fetched feed, adds it to the summary and prints a line for it."""
+        try:
+            stats = self._ingest(result)
+        except Exception as e:
+            result.error = f"Ingest failed: {type(e).__name__}: {e}"
+            stats = FeedStats(url=result.url, latency=result.latency, bytes_read=result.bytes_read, error=result.error)
+            stats.next_poll_in = self.scheduler.observe(result, 0)['next_poll_at'] - time.time()
+        summary.feeds.append(stats)
+        if stats.error:
+            print(f"Error fetching {stats.url}: {stats.error}")
+        elif stats.not_modified:
+            print(f"Unchanged {stats.url} ({stats.latency:.1f}s, next in {stats.next_poll_in / 60:.0f}m)")
+        else:
+            known = f" ({stats.skipped} known from the last poll)" if stats.skipped else ""
+            notes = ", stopped at stored entries" if stats.stopped_early else ""
+            notes += f", truncated at {config.FEED_MAX_BYTES // 1024} KiB" if stats.truncated else ""
+            print(f"Fetched {stats.url}: {stats.items} items, {stats.new_items} new, {stats.duplicates} duplicates{known} "
+                  f"({stats.latency:.1f}s, next in {stats.next_poll_in / 60:.0f}m{notes})")
 
 source_manager = SourceManager()
@@ -1,44 +1,236 @@
 import feedparser
+import hashlib
 import time
-import calendar
-from datetime import datetime
-from typing import List, Dict, Optional
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Iterator, List, Dict, Optional
+from config import config
+from sources.cache import FeedCache
+from sources.stream import FeedStream, feedparser_entry
+from sources.urls import clean_url, origin_url, url_key
+
+
+USER_AGENT = "Mozilla/5.0 (compatible; AI-News-Dashboard/0.1; +https://github.com/t0saki/AI-News-Dashboard)"
+# Entries can appear in a feed a while after their date (moderation, caches),
+# so parsing stops only at entries this much older than the newest stored one.
+WATERMARK_SLACK_SECONDS = 3600
+
+
+def cache_max_age(headers) -> Optional[float]:
+    """max-age from a Cache-Control header, in seconds."""
+    for directive in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name.lower() == 'max-age':
+            try:
+                return float(value.strip('"'))
+            except ValueError:
+                return None
+    return None
+
+
+@dataclass
+class FeedResult:
+    """Outcome of fetching a single feed."""
+    url: str
+    items: List[Dict] = field(default_factory=list)
+    bytes_read: int = 0
+    latency: float = 0.0
+    not_modified: bool = False # 304 or identical body; items is empty
+    truncated: bool = False # Body cut off at FEED_MAX_BYTES
+    stopped_early: bool = False # Parsing stopped at entries older than the newest stored one
+    error: Optional[str] = None
+    min_interval: Optional[float] = None # Server's poll hint in seconds (Cache-Control max-age, RSS <ttl>)
+    validators: Optional[Dict] = None # New cache entry, stored by RSSFetcher.commit once the items are saved
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 
 class RSSFetcher:
-    def parse_date(self, entry) -> float:
-        """Parse published date to timestamp."""
-        if hasattr(entry, 'published_parsed') and entry.published_parsed:
-            return calendar.timegm(entry.published_parsed)
-        if hasattr(entry, 'updated_parsed') and entry.updated_parsed:
-            return calendar.timegm(entry.updated_parsed)
-        return time.time()
+    def __init__(self, cache: Optional[FeedCache] = None, max_bytes: int = config.FEED_MAX_BYTES):
+        self.cache = cache
+        self.max_bytes = max_bytes
 
-    def fetch(self, url: str) -> List[Dict]:
+    def _download(self, url: str, timeout: Optional[float], validators: Optional[Dict] = None):
         """
-        Fetches an RSS feed and returns normalized items.
-        Returns list of dicts: {title, url, published_at, source_name, summary}
+        Downloads a feed body. Returns (content, etag, last_modified, max_age, truncated);
+        content, etag and last_modified are None when the server answers
+        304 Not Modified. Bodies over max_bytes are cut off there (truncated).
         """
+        # feedparser.parse(url) has no timeout, so we do the HTTP part ourselves
+        # and only hand the body to feedparser. Proxies come from HTTP(S)_PROXY.
+        # The socket timeout only bounds each recv, so the body is read with
+        # read1 (returns whatever one recv got) and the socket timeout shrinks
+        # to what is left of an overall deadline before each read. A slow-drip
+        # body is cut off within `timeout` of the request; connecting and the
+        # response headers are bounded by the socket timeout alone.
+        deadline = time.monotonic() + timeout if timeout else None
+        headers = {'User-Agent': USER_AGENT}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        request = urllib.request.Request(url, headers=headers)
+        chunks = []
+        size = 0
+        truncated = False
+        try:
+            response = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, None, None, cache_max_age(e.headers), False
+            raise
+        with response:
+            sock = getattr(getattr(response.fp, 'raw', None), '_sock', None)
+            while True:
+                if deadline:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"feed download exceeded {timeout}s")
+                    if sock is not None:
+                        sock.settimeout(remaining)
+                try:
+                    chunk = response.read1(64 * 1024)
+                except TimeoutError:
+                    raise TimeoutError(f"feed download exceeded {timeout}s") from None
+                if not chunk:
+                    break
+                if self.max_bytes and size + len(chunk) > self.max_bytes:
+                    chunks.append(chunk[:self.max_bytes - size])
+                    truncated = True
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            max_age = cache_max_age(response.headers)
+        return b"".join(chunks), etag, last_modified, max_age, truncated
+
+    def parse(self, url: str, content: bytes) -> List[Dict]:
+        """Parses a downloaded feed body into normalized items."""
+        return list(self.iter_items(url, content))
+
+    def _entries(self, url: str, content: bytes, truncated: bool, channel: Dict) -> Iterator[Dict]:
+        # Raw entries from the streaming parser; feedparser takes over (from
+        # the entry where it failed) for XML it rejects, such as HTML entities.
+        stream = FeedStream(content)
+        try:
+            for entry in stream:
+                channel['source_name'] = stream.source_name
+                yield entry
+            channel['ttl'] = stream.ttl
+            return
+        except ET.ParseError:
+            if truncated and stream.consumed:
+                return # Cut off at max_bytes: keep the entries read so far
+        feed = feedparser.parse(content)
+        if feed.bozo:
+            print(f"Warning parsing {url}: {feed.bozo_exception}")
+        channel['source_name'] = feed.feed.get('title')
         try:
-            feed = feedparser.parse(url)
-            if feed.bozo:
-                print(f"Warning parsing {url}: {feed.bozo_exception}")
-            
-            items = []
-            source_name = feed.feed.get('title', 'Unknown Source')
-            
-            for entry in feed.entries:
-                item = {
-                    'title': entry.get('title', 'No Title'),
-                    'url': entry.get('link', ''),
-                    'published_at': self.parse_date(entry),
-                    'source_name': source_name,
-                    'summary': entry.get('summary', '') or entry.get('description', '')
-                }
-                if item['url']:
-                    items.append(item)
-            
-            return items
+            channel['ttl'] = float(feed.feed.get('ttl')) * 60
+        except (TypeError, ValueError):
+            pass
+        for entry in feed.entries[stream.consumed:]:
+            yield feedparser_entry(entry)
+
+    def iter_items(self, url: str, content: bytes, since: Optional[float] = None, truncated: bool = False,
+                   channel: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        Yields normalized items one at a time from a downloaded feed body:
+        {title, url, url_key, guid, published_at, dated, source_name, summary}
+        (guid falls back to url_key for entries without one; undated entries
+        get the current time and dated=False).
+
+        With `since` (the newest published_at already stored for this feed),
+        stops after the first entry more than WATERMARK_SLACK_SECONDS older
+        than it, as long as the feed has been newest-first up to there. That
+        entry is still yielded, so the feed's publish gap stays measurable.
+        The channel's ttl (seconds) and whether it stopped early are written
+        into `channel` when given.
+        """
+        channel = {} if channel is None else channel
+        previous = None
+        for entry in self._entries(url, content, truncated, channel):
+            link = entry['link']
+            if not link:
+                continue
+            # Canonical link: the story's own URL, without tracking parameters.
+            link = clean_url(origin_url(link, entry['summary']))
+            published = entry['published_at']
+            key = url_key(link)
+            yield {
+                'title': entry['title'] or 'No Title',
+                'url': link,
+                'url_key': key,
+                'guid': entry['guid'] or key,
+                'published_at': published if published is not None else time.time(),
+                'dated': published is not None,
+                'source_name': channel.get('source_name') or 'Unknown Source',
+                'summary': entry['summary']
+            }
+            if published is None:
+                continue
+            if previous is not None and published > previous:
+                since = None # Not newest-first; read everything
+            previous = published
+            if since is not None and published < since - WATERMARK_SLACK_SECONDS:
+                channel['stopped_early'] = True
+                return
+
+    def fetch_feed(self, url: str, timeout: Optional[float] = None, since: Optional[float] = None,
+                   revalidate: bool = True) -> FeedResult:
+        """
+        Fetches an RSS feed and returns a FeedResult with normalized items,
+        latency and the error (if any). Never raises.
+        With a cache, sends conditional requests and skips parsing when the
+        feed is unchanged (result.not_modified, no items); revalidate=False
+        downloads and parses it regardless.
+        With `since`, parsing stops at entries older than that (see iter_items).
+        The new validators are only cached by commit(), so a body whose items
+        were never stored is not skipped as unchanged next time.
+        """
+        result = FeedResult(url=url)
+        start = time.monotonic()
+        try:
+            validators = self.cache.get(url) if self.cache and revalidate else None
+            content, etag, last_modified, result.min_interval, result.truncated = self._download(url, timeout, validators)
+            if content is None:
+                result.not_modified = True
+            else:
+                result.bytes_read = len(content)
+                content_hash = hashlib.sha256(content).hexdigest()
+                if validators and validators.get('content_hash') == content_hash:
+                    # Server ignored our validators but nothing changed; skip parsing.
+                    result.not_modified = True
+                else:
+                    channel = {}
+                    result.items = list(self.iter_items(url, content, since, result.truncated, channel))
+                    result.stopped_early = channel.get('stopped_early', False)
+                    if channel.get('ttl'):
+                        result.min_interval = max(channel['ttl'], result.min_interval or 0)
+                result.validators = {'etag': etag, 'last_modified': last_modified, 'content_hash': content_hash}
         except Exception as e:
-            print(f"Error fetching {url}: {e}")
-            return []
+            result.error = f"{type(e).__name__}: {e}"
+        result.latency = time.monotonic() - start
+        return result
+
+    def fetch(self, url: str, timeout: Optional[float] = None) -> List[Dict]:
+        """
+        Fetches an RSS feed and returns normalized items.
+        Returns list of dicts: {title, url, url_key, guid, published_at, source_name, summary}
+        """
+        result = self.fetch_feed(url, timeout=timeout)
+        if result.error:
+            print(f"Error fetching {url}: {result.error}")
+        self.commit(result)
+        return result.items
+
+    def commit(self, result: FeedResult):
+        """Caches the validators of a fetched body; call once its items are stored."""
+        if self.cache and result.validators:
+            self.cache.update(result.url, **result.validators)
@@ -0,0 +1,175 @@
+import random
+import statistics
+import threading
+import time
+from typing import Dict, List, Optional
+from config import config
+from database import db
+from sources.rss import FeedResult, WATERMARK_SLACK_SECONDS
+from sources.urls import url_hash
+
+BACKOFF_IDLE = 1.5 # Interval growth per poll that found nothing new
+RECENT_ITEMS = 20 # Newest entries used to estimate a feed's publish gap
+FULL_PARSE_EVERY = 6 # Every Nth poll reads the whole feed, to notice entries that show up late
+MAX_SEEN_GUIDS = 2000 # Per feed; raised to the feed's length when it lists more
+
+
+class FeedScheduler:
+    """
+    Per-feed adaptive poll schedule, persisted in the feed_state table.
+
+    After every poll the feed's next interval is derived from how often it
+    publishes (half the median gap between its newest entries), grows by
+    BACKOFF_IDLE while polls find nothing new, and backs off exponentially on
+    errors. It always stays within FEED_MIN/MAX_INTERVAL_SECONDS and never
+    goes below what the server asks for via RSS <ttl> or Cache-Control max-age.
+    It also keeps each feed's high-water mark: the newest entry date seen and
+    the GUIDs of the last poll. Entries with a known GUID never reach the DB
+    (unseen), and polls may stop parsing below the date (parse_since).
+    Feeds that list entries well below the mark that were not there before
+    (e.g. hnrss point thresholds, which keep submission dates) are always
+    parsed in full.
+    """
+
+    def __init__(self, feeds: List[str], initial_interval: float = config.FETCH_INTERVAL_SECONDS,
+                 min_interval: float = config.FEED_MIN_INTERVAL_SECONDS,
+                 max_interval: float = config.FEED_MAX_INTERVAL_SECONDS):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        stored = db.get_feed_states()
+        self.states: Dict[str, Dict] = {}
+        for url in feeds:
+            self.states[url] = stored.get(url) or {
+                'url': url,
+                'interval_seconds': float(initial_interval),
+                'next_poll_at': 0.0, # Poll new feeds right away
+                'server_min_interval': 0.0,
+                'last_polled_at': None,
+                'last_new_at': None,
+                'errors': 0,
+                'newest_published_at': None,
+                'seen_guids': [],
+                'late_entries': 0,
+                'polls_since_full': 0,
+                'last_items': 0,
+                'last_new_items': 0,
+                'last_skipped': 0,
+                'last_bytes': 0,
+                'last_latency': None,
+            }
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        """Feeds whose next poll time has come."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            return [url for url, state in self.states.items() if state['next_poll_at'] <= now]
+
+    def seconds_until_next(self, now: Optional[float] = None) -> float:
+        now = now if now is not None else time.time()
+        with self._lock:
+            next_poll = min((state['next_poll_at'] for state in self.states.values()), default=now + self.max_interval)
+        return max(0.0, next_poll - now)
+
+    def parse_since(self, url: str) -> Optional[float]:
+        """
+        Date below which this poll may stop parsing (RSSFetcher.iter_items),
+        or None for a full parse: until the feed has a high-water mark, every
+        FULL_PARSE_EVERY polls, and always for feeds that have had late entries.
+        """
+        with self._lock:
+            state = self.states.get(url)
+            if (not state or not state['seen_guids'] or state['late_entries']
+                    or state['polls_since_full'] + 1 >= FULL_PARSE_EVERY):
+                return None
+            return state['newest_published_at']
+
+    def partially_read(self, url: str) -> bool:
+        """True when the feed's last parses stopped early, so a full parse must not skip an unchanged body."""
+        with self._lock:
+            state = self.states.get(url)
+            return bool(state and state['polls_since_full'])
+
+    def unseen(self, url: str, items: List[Dict]) -> List[Dict]:
+        """
+        Items whose GUID the feed's last poll did not list. An unseen entry
+        dated well below the high-water mark is a late one: it is kept, and
+        the feed is parsed in full from then on.
+        """
+        with self._lock:
+            state = self.states.get(url)
+            if not state or not state['seen_guids']:
+                return list(items)
+            seen = set(state['seen_guids'])
+            fresh = [item for item in items if url_hash(item['guid']) not in seen]
+            floor = (state['newest_published_at'] or 0) - WATERMARK_SLACK_SECONDS
+            late = sum(1 for item in fresh if item['published_at'] < floor)
+            if late and not state['late_entries']:
+                print(f"Feed {url} lists {late} new entries below its high-water mark; parsing it in full from now on")
+            state['late_entries'] += late
+            return fresh
+
+    def _clamp(self, interval: float, server_min: float) -> float:
+        return max(self.min_interval, server_min, min(interval, self.max_interval))
+
+    @staticmethod
+    def _publish_gap(items: List[Dict]) -> Optional[float]:
+        # Undated entries carry the fetch time, which says nothing about the feed's pace.
+        published = sorted((item['published_at'] for item in items if item.get('published_at') and item.get('dated', True)), reverse=True)
+        gaps = [a - b for a, b in zip(published, published[1:RECENT_ITEMS]) if a > b]
+        return statistics.median(gaps) if gaps else None
+
+    def observe(self, result: FeedResult, new_items: int, skipped: int = 0, now: Optional[float] = None) -> Dict:
+        """Updates a feed's schedule and high-water mark after a poll and returns its state."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            state = self.states[result.url]
+            state.update(last_items=len(result.items), last_new_items=new_items, last_skipped=skipped,
+                         last_bytes=result.bytes_read, last_latency=result.latency)
+            if result.min_interval is not None:
+                state['server_min_interval'] = result.min_interval
+            interval = state['interval_seconds']
+
+            if result.error:
+                state['errors'] += 1
+                delay = self._clamp(interval * (2 ** min(state['errors'], 6)), state['server_min_interval'])
+            else:
+                state['errors'] = 0
+                # Future-dated entries are clamped so they cannot hide later ones;
+                # undated ones (stamped with the fetch time) would do the same.
+                newest = min(max((item['published_at'] for item in result.items if item.get('dated', True)), default=0), now)
+                if newest > (state['newest_published_at'] or 0):
+                    state['newest_published_at'] = newest
+                if result.not_modified:
+                    # Still only partly read; keep counting towards the next full parse.
+                    state['polls_since_full'] += 1 if state['polls_since_full'] else 0
+                else:
+                    guids = list(dict.fromkeys(url_hash(item['guid']) for item in result.items))
+                    # Every GUID the feed lists is kept, or the oldest ones would
+                    # look new (and late) on each full parse.
+                    limit = max(MAX_SEEN_GUIDS, len(guids))
+                    if result.stopped_early:
+                        # Only the top was read; what is below is still listed.
+                        limit = max(limit, len(state['seen_guids']))
+                        guids = list(dict.fromkeys(guids + state['seen_guids']))
+                    state['seen_guids'] = guids[:limit]
+                    state['polls_since_full'] = state['polls_since_full'] + 1 if result.stopped_early else 0
+                if new_items:
+                    state['last_new_at'] = now
+                    gap = self._publish_gap(result.items)
+                    interval = gap / 2 if gap else interval / 2
+                else:
+                    interval *= BACKOFF_IDLE
+                interval = self._clamp(interval, state['server_min_interval'])
+                state['interval_seconds'] = interval
+                delay = interval
+
+            state['last_polled_at'] = now
+            # A little jitter so feeds on one host drift apart instead of firing together.
+            state['next_poll_at'] = now + delay * random.uniform(0.9, 1.1)
+            return dict(state)
+
+    def save(self):
+        with self._lock:
+            states = [dict(state) for state in self.states.values()]
+        db.save_feed_states(states)
@@ -0,0 +1,133 @@
+import calendar
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, Optional
+
+CHUNK_SIZE = 64 * 1024 # Bytes fed to the XML parser at a time
+SUMMARY_MAX_CHARS = 4096 # Only the lead is used (dedup shingles, origin_url); the rest is dropped
+
+ENTRY_TAGS = {'item', 'entry'} # RSS 2.0 / RSS 1.0 <item>, Atom <entry>
+FEED_TAGS = {'channel', 'feed'}
+DATE_TAGS = ('pubDate', 'published', 'updated', 'date', 'issued', 'modified') # In order of preference
+SUMMARY_TAGS = ('description', 'summary', 'encoded', 'content')
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_timestamp(text: Optional[str]) -> Optional[float]:
+    """RFC 822 (RSS) or ISO 8601 (Atom, Dublin Core) date as a UTC timestamp."""
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        parsed = parsedate_to_datetime(text)
+    except (TypeError, ValueError, IndexError):
+        try:
+            parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _entry(elem: ET.Element) -> Dict:
+    """Raw fields of one <item>/<entry>: title, link, guid, summary, published_at (None if undated)."""
+    fields = {}
+    links = []
+    guid = None
+    permalink = False
+    for child in elem:
+        name = _local(child.tag)
+        if name == 'link':
+            # RSS: <link>url</link>; Atom: <link rel="alternate" href="url"/>
+            href = child.get('href')
+            if href is None:
+                href = (child.text or '').strip()
+            if href and child.get('rel', 'alternate') == 'alternate':
+                links.append(href)
+        elif name == 'guid':
+            guid = (child.text or '').strip()
+            permalink = child.get('isPermaLink', 'true').lower() != 'false'
+        elif name not in fields:
+            fields[name] = ''.join(child.itertext())
+    link = links[0] if links else guid if permalink and guid.startswith(('http://', 'https://')) else ''
+    summary = next((fields[tag] for tag in SUMMARY_TAGS if fields.get(tag)), '')
+    published = next((ts for ts in (parse_timestamp(fields.get(tag)) for tag in DATE_TAGS) if ts is not None), None)
+    return {
+        'title': (fields.get('title') or '').strip(),
+        'link': link,
+        'guid': guid or (fields.get('id') or '').strip(), # RSS <guid>, Atom <id>
+        'summary': summary[:SUMMARY_MAX_CHARS],
+        'published_at': published,
+    }
+
+
+class FeedStream:
+    """
+    Incremental RSS 2.0 / RSS 1.0 / Atom parser over a downloaded body.
+
+    Iterating yields one raw entry dict at a time (see _entry). Each element
+    is dropped from the tree once read, so memory stays at one entry plus
+    the parser's buffer, however many entries the feed has. The channel
+    title and <ttl> are filled in as they are reached; both come before the
+    entries in practice.
+
+    Raises xml.etree.ElementTree.ParseError on malformed XML (e.g. HTML
+    entities feedparser would accept). `consumed` tells how many entries
+    were yielded before that point.
+    """
+
+    def __init__(self, content: bytes, chunk_size: int = CHUNK_SIZE):
+        self.content = content
+        self.chunk_size = chunk_size
+        self.source_name: Optional[str] = None
+        self.ttl: Optional[float] = None # Seconds (RSS <ttl> is in minutes)
+        self.consumed = 0
+
+    def __iter__(self) -> Iterator[Dict]:
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        stack = []
+        view = memoryview(self.content)
+        for offset in range(0, len(view), self.chunk_size):
+            parser.feed(view[offset:offset + self.chunk_size].tobytes())
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    stack.append(elem)
+                    continue
+                stack.pop()
+                name = _local(elem.tag)
+                parent = _local(stack[-1].tag) if stack else None
+                if name in ENTRY_TAGS:
+                    self.consumed += 1
+                    yield _entry(elem)
+                    if stack:
+                        stack[-1].remove(elem)
+                elif parent in FEED_TAGS:
+                    if name == 'title' and self.source_name is None:
+                        self.source_name = (elem.text or '').strip() or None
+                    elif name == 'ttl':
+                        try:
+                            self.ttl = float(elem.text) * 60
+                        except (TypeError, ValueError):
+                            pass
+        parser.close()
+
+
+def feedparser_entry(entry) -> Dict:
+    """The same raw entry dict from a feedparser entry (fallback for malformed feeds)."""
+    published = None
+    for key in ('published_parsed', 'updated_parsed'):
+        if entry.get(key):
+            published = calendar.timegm(entry[key])
+            break
+    return {
+        'title': entry.get('title', ''),
+        'link': entry.get('link', ''),
+        'guid': entry.get('id', ''),
+        'summary': (entry.get('summary', '') or entry.get('description', ''))[:SUMMARY_MAX_CHARS],
+        'published_at': published,
+    }
@@ -0,0 +1,111 @@
+import hashlib
+import html
+import re
+from collections import deque
+from typing import Iterable, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+# Query parameters that only track where a click came from.
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'gclsrc', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_hsenc', '_hsmi', 'mkt_tok', 'ref', 'ref_src', 'ref_url', 'spm', 'share', 'cmpid',
+}
+TRACKING_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Aggregators whose entries link to their own discussion page; the story's
+# own URL is in the entry body (e.g. hnrss "Article URL: <a href=...>").
+DISCUSSION_PAGES = {('news.ycombinator.com', '/item')}
+_ARTICLE_URL_RE = re.compile(r'Article URL:\s*<a href="([^"]+)"', re.IGNORECASE)
+
+
+def _is_tracking(param: str) -> bool:
+    name = param.split('=', 1)[0].lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def origin_url(link: str, summary: str = "") -> str:
+    """The story's own URL when link points at an aggregator's discussion page."""
+    parts = urlsplit(link)
+    if ((parts.hostname or '').lower(), parts.path) in DISCUSSION_PAGES:
+        match = _ARTICLE_URL_RE.search(summary or "")
+        if match:
+            return html.unescape(match.group(1))
+    return link
+
+
+def clean_url(url: str) -> str:
+    """
+    The link as stored and shown: tracking parameters and fragment dropped,
+    host lowercased, default port removed. Everything else is kept as is,
+    so the link still works.
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return url
+    netloc = parts.hostname
+    try:
+        if parts.port and parts.port != DEFAULT_PORTS[scheme]:
+            netloc += f":{parts.port}"
+    except ValueError: # Malformed port
+        return url
+    query = "&".join(p for p in parts.query.split('&') if p and not _is_tracking(p))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def url_key(url: str) -> str:
+    """
+    Identity of a link for duplicate detection: clean_url, plus http/https
+    and a leading "www." folded together, no trailing slash, and query
+    parameters sorted.
+    """
+    parts = urlsplit(clean_url(url))
+    if parts.scheme not in DEFAULT_PORTS:
+        return url.strip()
+    host = parts.netloc[4:] if parts.netloc.startswith('www.') else parts.netloc
+    path = parts.path.rstrip('/') or '/'
+    query = "&".join(sorted(p for p in parts.query.split('&') if p))
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+def url_hash(key: str) -> int:
+    """Signed 64-bit hash of a url_key (fits an SQLite INTEGER)."""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+class SeenUrls:
+    """
+    Bounded in-memory set of recently seen url_keys, oldest evicted first.
+
+    Keys are kept as 64-bit hashes (a collision among a few hundred thousand
+    entries is vanishingly unlikely), well under 100 bytes per entry instead
+    of the full strings. Anything evicted is still caught by the
+    UNIQUE index on news.url_key; this only saves the round trip.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._seen = set()
+        self._order = deque() # Oldest first
+
+    def __contains__(self, key: str) -> bool:
+        return url_hash(key) in self._seen
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def add(self, key: str):
+        digest = url_hash(key)
+        if digest in self._seen:
+            return
+        self._seen.add(digest)
+        self._order.append(digest)
+        if len(self._order) > self.max_entries:
+            self._seen.discard(self._order.popleft())
+
+    def update(self, keys: Iterable[Optional[str]]):
+        for key in keys:
+            if key:
+                self.add(key)